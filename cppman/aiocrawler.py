@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# aiocrawler.py - asyncio crawling engine
+#
+# Copyright (C) 2010 - 2016  Wei-Ning Huang (AZ) <aitjcize@gmail.com>
+# All Rights reserved.
+#
+# This file is part of cppman.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import asyncio
+import collections
+import http.client
+import io
+import ssl
+from urllib.parse import urlparse
+
+from cppman import util
+
+
+class AsyncFetcher(object):
+    """Minimal HTTP/1.1 client on asyncio streams.
+
+    Connections are kept alive and reused per (scheme, host), and at most
+    per_host requests (0 for no limit) run against the same host at once.
+    """
+
+    def __init__(self, per_host=0, timeout=10):
+        self.per_host = per_host
+        self.timeout = timeout
+        self._idle = collections.defaultdict(list)
+        self._limits = {}
+        self._ssl = None
+
+    async def _open(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            if self._ssl is None:
+                self._ssl = ssl.create_default_context()
+            return await asyncio.open_connection(
+                host, port, ssl=self._ssl, server_hostname=host)
+        return await asyncio.open_connection(host, port)
+
+    async def request(self, url, headers=None):
+        """Send a GET request for url and return its util.Response.
+
+        Redirections are not followed.
+        """
+        parts = urlparse(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError('unsupported URL scheme: %s' % url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        lines = ['GET %s HTTP/1.1' % path, 'Host: %s' % parts.netloc,
+                 'User-Agent: %s' % util._USER_AGENT,
+                 'Accept-Encoding: identity']
+        lines += ['%s: %s' % item for item in (headers or {}).items()]
+        data = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+        if self.per_host and key not in self._limits:
+            self._limits[key] = asyncio.Semaphore(self.per_host)
+        limit = self._limits.get(key)
+
+        if limit is not None:
+            async with limit:
+                return await asyncio.wait_for(
+                    self._request(key, url, data), self.timeout)
+        return await asyncio.wait_for(
+            self._request(key, url, data), self.timeout)
+
+    async def _request(self, key, url, data):
+        while True:
+            reused = bool(self._idle[key])
+            reader, writer = (self._idle[key].pop() if reused
+                              else await self._open(key))
+            try:
+                writer.write(data)
+                await writer.drain()
+                status_line = await reader.readline()
+                if not status_line:
+                    raise ConnectionResetError('connection closed by server')
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                # The server closed an idle connection, retry on a new one
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+
+            try:
+                res, keep_alive = await self._read_response(
+                    url, status_line, reader)
+            except BaseException:
+                writer.close()
+                raise
+
+            if keep_alive:
+                self._idle[key].append((reader, writer))
+            else:
+                writer.close()
+            return res
+
+    async def _read_response(self, url, status_line, reader):
+        version, status, reason = (
+            status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) +
+            [''])[:3]
+        if not version.startswith('HTTP/'):
+            raise http.client.BadStatusLine(status_line)
+        status = int(status)
+
+        header_data = await reader.readuntil(b'\r\n\r\n')
+        headers = http.client.parse_headers(io.BytesIO(header_data))
+
+        keep_alive = 'close' not in headers.get('Connection', '').lower()
+        if version == 'HTTP/1.0':
+            keep_alive = 'keep-alive' in headers.get('Connection', '').lower()
+
+        if status < 200 or status in (204, 304):
+            body = b''
+        elif 'chunked' in headers.get('Transfer-Encoding', '').lower():
+            chunks = []
+            while True:
+                size = await reader.readline()
+                size = int(size.split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    # Skip trailers
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b''.join(chunks)
+        elif headers.get('Content-Length') is not None:
+            body = await reader.readexactly(int(headers['Content-Length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+
+        return util.Response(url, status, reason, headers, body), keep_alive
+
+    async def close(self):
+        """Close all idle connections."""
+        idle, self._idle = self._idle, collections.defaultdict(list)
+        for conns in idle.values():
+            for reader, writer in conns:
+                writer.close()
+
+
+async def _fetch(crawler, fetcher, depth, url):
+    try:
+        res = crawler._stored_response(url)
+        if res is None:
+            res = await fetcher.request(url, crawler.request_headers(url))
+            crawler._store_response(url, res)
+    except Exception as err:
+        print("URL failed ({}): {}".format(url, err or type(err).__name__))
+        crawler._target_failed(url, depth)
+    else:
+        # A page that cannot be processed is lost, not the whole crawl
+        try:
+            crawler._visit(url, depth, res)
+        except Exception as err:
+            print("Processing failed ({}): {}".format(
+                url, err or type(err).__name__))
+    crawler._target_done(url, depth)
+
+
+async def _crawl(crawler):
+    fetcher = AsyncFetcher(crawler.max_per_host)
+    pending = set()
+    try:
+        while True:
+            while len(pending) < crawler.max_outstanding:
+                target = crawler._next_target()
+                if target is None:
+                    break
+                depth, url = target
+                pending.add(asyncio.ensure_future(
+                    _fetch(crawler, fetcher, depth, url)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+    finally:
+        # Cancel outstanding requests on errors and Ctrl-C
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await fetcher.close()
+
+
+def run(crawler):
+    """Crawl all targets of crawler with up to crawler.max_outstanding
+    requests in flight on an asyncio event loop."""
+    asyncio.run(_crawl(crawler))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# client.py - Client of the lookup daemon
+#
+# Copyright (C) 2010 - 2015  Wei-Ning Huang (AZ) <aitjcize@gmail.com>
+# All Rights reserved.
+#
+# This file is part of cppman.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import base64
+import json
+import os
+import socket
+
+from cppman import environ
+
+# Seconds to wait for the daemon to connect and answer, a daemon that hangs
+# is given up on and the lookup done in-process
+TIMEOUT = 5
+
+
+def lookup(pattern, columns=80, forced=False, render=False):
+    """Resolve pattern with a running daemon.
+
+    Returns a dict with the 'title', 'keyword', 'url' and gzipped cached
+    'page' of the best match, plus the rendered 'text' of the page if render
+    is true.
+    Returns None if no daemon is running or it does not answer in time.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(TIMEOUT)
+    try:
+        sock.connect(environ.daemon_socket)
+    except OSError:
+        sock.close()
+        return None
+
+    request = {
+        'pattern': pattern,
+        'source': environ.source,
+        'columns': columns,
+        'forced': forced,
+        'render': render,
+        'locale': [os.getenv('LC_ALL', ''), os.getenv('LANG', '')],
+    }
+
+    try:
+        with sock:
+            sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            data = sock.makefile('rb').readline()
+    except (socket.timeout, OSError):
+        return None
+
+    if not data:
+        return None
+
+    response = json.loads(data.decode('utf-8'))
+    if 'error' in response:
+        raise RuntimeError(response['error'])
+    response['page'] = base64.b64decode(response['page'])
+    return response
@@ -33,7 +33,9 @@ class Config(object):
     DEFAULTS = {
         'Source': 'cppreference.com',
         'UpdateManPath': 'false',
-        'Pager': 'less'
+        'Pager': 'less',
+        'CacheSize': '0',
+        'SharedCache': ''
     }
 
     def __init__(self, configfile):
@@ -24,37 +24,29 @@
 
 from __future__ import print_function
 
+import collections
+import heapq
 import re
 import sys
 import time
 from threading import Lock, Thread
 from urllib.parse import urljoin, urlparse, urlunparse
-import urllib.request
-import urllib.error
-import http.client
 import cppman.util
 
-from bs4 import BeautifulSoup
-
 # See https://tools.ietf.org/html/rfc3986#section-3.3
 _CONTAINS_DISALLOWED_URL_PCHAR_RE = re.compile('[\x00-\x20\x7f]')
 
-class NoRedirection(urllib.request.HTTPErrorProcessor):
-    """A handler that disables redirection"""
-    def http_response(self, request, response):
-        if response.code in Crawler.F_REDIRECT_CODES:
-            return response
-        return super().http_response(request, response)
-
-    https_response = http_response
-
 class Crawler(object):
     F_ANY, F_SAME_HOST, F_SAME_PATH = list(range(3))
-    F_REDIRECT_CODES = (301, 302)
+    F_REDIRECT_CODES = (301, 302, 303, 307, 308)
+    E_THREADS, E_ASYNCIO = ENGINES = ('threads', 'asyncio')
 
     def __init__(self):
         self.queued = set()
-        self.targets = set()
+        # heap of (depth, url), shallowest (then smallest) URL first
+        self.targets = []
+        # targets handed to a worker that are not done yet
+        self.in_flight = set()
         self.failed_targets = set()
         self.max_failed_retries = 3
         self.failed_retry = 0
@@ -62,20 +54,37 @@ class Crawler(object):
         self.threads = []
         self.concurrency = 0
         self.max_outstanding = 16
+        self.max_per_host = 0
+        self.engine = self.E_THREADS
         self.max_depth = 0
         self.follow_mode = self.F_SAME_HOST
         self.content_type_filter = '(text/html)'
         self.url_filters = []
+        # all url_filters as one pattern, filter i is the group '_uf<i>'
+        self.url_filter_re = None
+        # number of URLs rejected by each filter
+        self.url_filter_hits = collections.Counter()
         self.prefix_filter = '^(#|javascript:|mailto:)'
+        self.checkpoint_interval = 0
+        self.last_checkpoint = 0
+        # fetched pages are read from and saved to html_store
+        self.html_store = None
+        self.html_store_max_age = 0
 
         self.targets_lock = Lock()
         self.concurrency_lock = Lock()
+        self.checkpoint_lock = Lock()
 
     def set_content_type_filter(self, cf):
         self.content_type_filter = '(%s)' % ('|'.join(cf))
 
     def add_url_filter(self, uf):
+        """Don't fetch URLs matching the regular expression uf"""
+        if uf in self.url_filters:
+            return
         self.url_filters.append(uf)
+        self.url_filter_re = re.compile('|'.join(
+            '(?P<_uf%d>%s)' % (i, f) for i, f in enumerate(self.url_filters)))
 
     def set_follow_mode(self, mode):
         if mode > 2:
@@ -85,9 +94,46 @@ class Crawler(object):
     def set_concurrency_level(self, level):
         self.max_outstanding = level
 
+    def set_per_host_limit(self, level):
+        """Limit concurrent requests per host, 0 for no limit (asyncio)"""
+        self.max_per_host = level
+
+    def set_engine(self, engine):
+        if engine not in self.ENGINES:
+            raise RuntimeError('invalid crawling engine %s.' % engine)
+        self.engine = engine
+
     def set_max_depth(self, max_depth):
         self.max_depth = max_depth
 
+    def set_html_store(self, store, max_age):
+        """Use the pages in the htmlstore.HTMLStore store that were fetched
+        in the last max_age seconds instead of fetching them again"""
+        self.html_store = store
+        self.html_store_max_age = max_age
+
+    def set_checkpoint_interval(self, seconds):
+        """Call checkpoint() every seconds while crawling, 0 to disable"""
+        self.checkpoint_interval = seconds
+
+    def get_state(self):
+        """Return the frontier and the visited URLs in a form that can be
+        serialized to JSON and passed to set_state() to resume crawling."""
+        with self.targets_lock:
+            targets = set(self.targets) | self.in_flight | self.failed_targets
+            queued = list(self.queued)
+        return {'targets': sorted(targets), 'queued': queued}
+
+    def set_state(self, state):
+        """Restore the frontier and the visited URLs from get_state()"""
+        with self.targets_lock:
+            # A sorted list is a valid heap
+            self.targets = sorted((depth, url)
+                                  for depth, url in state['targets'])
+            self.queued = set(state['queued'])
+            self.in_flight = set()
+            self.failed_targets = set()
+
     def link_parser(self, url, content):
         links = re.findall(r'''href\s*=\s*['"]\s*([^'"]+)['"]''', content)
         links = [self._fix_link(url, link) for link in links]
@@ -100,26 +146,18 @@ class Crawler(object):
         self.url = self.url._replace(fragment="")
 
         self.failed_targets = set()
+        self.url_filter_hits.clear()
         self.downloaded = True
         self.failed_retry = self.max_failed_retries
+        self.last_checkpoint = time.time()
 
         self._add_target(url, 1)
         while True:
-            self._spawn_new_worker()
-
-            while True:
-                with self.concurrency_lock:
-                    threads = list(self.threads)
-                if not threads:
-                    break
-                try:
-                    for t in threads:
-                        t.join(1)
-                        if not t.is_alive():
-                            with self.concurrency_lock:
-                                self.threads.remove(t)
-                except KeyboardInterrupt:
-                    sys.exit(1)
+            if self.engine == self.E_ASYNCIO:
+                from cppman import aiocrawler
+                aiocrawler.run(self)
+            else:
+                self._run_threads()
 
             n_failed = len(self.failed_targets)
             if n_failed == 0:
@@ -133,7 +171,8 @@ class Crawler(object):
                 break
             print("Some URLs failed to download ({}). Retrying ({})...".format(
                   n_failed, self.failed_retry))
-            self.targets = self.failed_targets
+            # A sorted list is a valid heap
+            self.targets = sorted(self.failed_targets)
             self.failed_targets = set()
             self.downloaded = False
             time.sleep(2)
@@ -142,13 +181,56 @@ class Crawler(object):
             print("=== Failed URLs ({}):".format(len(self.failed_targets)))
             for depth, url in self.failed_targets:
                 print("{} (depth {})".format(url, depth))
+        for uf in self.url_filters:
+            if self.url_filter_hits[uf]:
+                print("=== Filtered URLs ({}): {}".format(
+                    self.url_filter_hits[uf], uf))
         print("=== Done {}".format(url))
 
-    def process_document(self, url, content, depth):
-        """callback to insert index"""
+    def _run_threads(self):
+        """Crawl all targets with worker threads"""
+        self._spawn_new_worker()
+
+        while True:
+            with self.concurrency_lock:
+                threads = list(self.threads)
+            if not threads:
+                break
+            try:
+                for t in threads:
+                    t.join(1)
+                    if not t.is_alive():
+                        with self.concurrency_lock:
+                            self.threads.remove(t)
+            except KeyboardInterrupt:
+                sys.exit(1)
+
+    def process_document(self, url, content, depth, headers=None):
+        """callback to insert index, headers are those of the response"""
         # Should be implemented by a derived class. Make pylint happy
         return True
 
+    def process_unmodified(self, url, depth):
+        """callback for a 304 response to the conditional request_headers"""
+        # Should be implemented by a derived class.
+        pass
+
+    def process_gone(self, url, depth):
+        """callback for a URL that is not found, or redirects elsewhere"""
+        # Should be implemented by a derived class.
+        pass
+
+    def request_headers(self, url):
+        """callback returning extra request headers for url, e.g. to make
+        the request conditional"""
+        # Should be implemented by a derived class.
+        return None
+
+    def checkpoint(self):
+        """callback to save the crawl state, see get_state()"""
+        # Should be implemented by a derived class.
+        pass
+
     def _fix_link(self, root, link):
         # Encode invalid characters
         link = re.sub(_CONTAINS_DISALLOWED_URL_PCHAR_RE,
@@ -183,12 +265,48 @@ class Crawler(object):
             if url in self.queued:
                 return
             self.queued.add(url)
-            self.targets.add((depth, url))
+
+            if self.url_filter_re:
+                m = self.url_filter_re.search(url)
+                if m:
+                    name = next(k for k, v in m.groupdict().items()
+                                if v is not None and k.startswith('_uf'))
+                    self.url_filter_hits[self.url_filters[int(name[3:])]] += 1
+                    return
+
+            heapq.heappush(self.targets, (depth, url))
+
+    def _next_target(self):
+        """Pop the next (depth, url) to fetch, None if there is none.
+
+        The target must be passed to _target_done() once it is handled.
+        """
+        with self.targets_lock:
+            if not self.targets:
+                return None
+            target = heapq.heappop(self.targets)
+            self.in_flight.add(target)
+            return target
 
     def _target_failed(self, url, depth):
         with self.targets_lock:
             self.failed_targets.add((depth, url))
 
+    def _target_done(self, url, depth):
+        with self.targets_lock:
+            self.in_flight.discard((depth, url))
+
+        if (not self.checkpoint_interval or
+                time.time() - self.last_checkpoint < self.checkpoint_interval):
+            return
+        # Only one worker saves the checkpoint, the others carry on
+        if self.checkpoint_lock.acquire(blocking=False):
+            try:
+                self.last_checkpoint = time.time()
+                self.checkpoint()
+            finally:
+                self.checkpoint_lock.release()
+
     def _spawn_new_worker(self):
         with self.concurrency_lock:
             if self.concurrency < self.max_outstanding:
@@ -200,58 +318,75 @@ class Crawler(object):
 
     def _worker(self, sid):
         while True:
-            with self.targets_lock:
-                if not self.targets:
-                    break
-                depth, url = sorted(self.targets)[0]
-                self.targets.remove((depth, url))
-
-            opener = cppman.util.build_opener(NoRedirection)
-            request_error = None
+            target = self._next_target()
+            if target is None:
+                break
+            depth, url = target
+
             try:
-                res = opener.open(url, timeout=10)
-                with self.targets_lock:
-                    self.downloaded = True
-            except urllib.error.HTTPError as err:
-                if err.code == 404:
-                    continue
-                request_error = err
+                res = self._stored_response(url)
+                if res is None:
+                    res = cppman.util.pool.request(url,
+                                                   self.request_headers(url))
+                    self._store_response(url, res)
             except Exception as err:
-                request_error = err
-            if request_error is not None:
-                print("URL failed ({}): {}".format(url, request_error))
+                print("URL failed ({}): {}".format(url, err))
                 self._target_failed(url, depth)
-                continue
+            else:
+                self._visit(url, depth, res)
+                self._spawn_new_worker()
+            self._target_done(url, depth)
 
-            if res.status in self.F_REDIRECT_CODES:
-                target = self._fix_link(url, res.getheader('location'))
-                self._add_target(target, depth+1)
-                continue
+        with self.concurrency_lock:
+            self.concurrency -= 1
 
-            # Check content type
-            try:
-                if not re.search(
-                    self.content_type_filter,
-                        res.getheader('Content-Type')):
-                    continue
-            except TypeError:  # getheader result is None
-                print("Getting Content-Type failed ({})".format(url))
-                continue
+    def _stored_response(self, url):
+        """Return the fresh copy of url in html_store, None if there is none"""
+        if self.html_store is None:
+            return None
+        return self.html_store.response(url, self.html_store_max_age)
 
-            try:
-                content = res.read().decode()
-            except http.client.HTTPException as err:
-                print("Content read() failed ({}): {}".format(url, err))
-                self._target_failed(url, depth)
-                continue
+    def _store_response(self, url, res):
+        if self.html_store is not None:
+            self.html_store.put(url, res)
 
-            if self.process_document(url, content, depth):
-                # Find links in document
-                links = self.link_parser(url, content)
-                for link in links:
-                    self._add_target(link, depth+1)
+    def _visit(self, url, depth, res):
+        """Handle the response res of a target, shared by all engines"""
+        if res.status == 404:
+            self.process_gone(url, depth)
+            return
+        if res.status >= 400:
+            print("URL failed ({}): HTTP Error {}: {}".format(
+                url, res.status, res.reason))
+            self._target_failed(url, depth)
+            return
+        with self.targets_lock:
+            self.downloaded = True
 
-            self._spawn_new_worker()
+        if res.status == 304:
+            self.process_unmodified(url, depth)
+            return
 
-        with self.concurrency_lock:
-            self.concurrency -= 1
+        if res.status in self.F_REDIRECT_CODES:
+            target = self._fix_link(url, res.getheader('location'))
+            self._add_target(target, depth+1)
+            self.process_gone(url, depth)
+            return
+
+        # Check content type
+        try:
+            if not re.search(
+                self.content_type_filter,
+                    res.getheader('Content-Type')):
+                return
+        except TypeError:  # getheader result is None
+            print("Getting Content-Type failed ({})".format(url))
+            return
+
+        content = res.read().decode()
+
+        if self.process_document(url, content, depth, res.headers):
+            # Find links in document
+            links = self.link_parser(url, content)
+            for link in links:
+                self._add_target(link, depth+1)
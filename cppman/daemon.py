@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+# daemon.py - Lookup daemon keeping the index in memory
+#
+# Copyright (C) 2010 - 2015  Wei-Ning Huang (AZ) <aitjcize@gmail.com>
+# All Rights reserved.
+#
+# This file is part of cppman.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import base64
+import collections
+import json
+import os
+import signal
+import socket
+import socketserver
+import sqlite3
+import sys
+import threading
+
+from cppman import environ, util
+from cppman.main import Cppman
+from cppman.pageformat import plain_text
+
+# Number of rendered pages kept in memory
+RENDER_CACHE_SIZE = 128
+
+
+class DaemonCppman(Cppman):
+    """Cppman searching the in-memory copy of the index."""
+
+    def __init__(self, index_uri, stores, **kwargs):
+        Cppman.__init__(self, **kwargs)
+        self.index_uri = index_uri
+        self.page_store = stores.page_store
+        self.html_store = stores.html_store
+
+    def _open_index(self):
+        return sqlite3.connect(self.index_uri, uri=True)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # Probe of another daemon checking whether we are alive
+            return
+        try:
+            request = json.loads(line.decode('utf-8'))
+            response = self.server.lookup(request)
+        except Exception as e:
+            response = {'error': str(e)}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        socketserver.UnixStreamServer.__init__(self, path, Handler)
+        self.index_lock = threading.Lock()
+        self.index_conn = None
+        self.index_uri = None
+        self.index_stat = None
+        self.generation = 0
+
+        self.pages = collections.OrderedDict()
+        self.pages_lock = threading.Lock()
+        self.stores = None
+        self.stores_lock = threading.Lock()
+
+    def _load_index(self):
+        """Return the URI of the in-memory index, (re)loading index.db
+        if it changed since it was last loaded."""
+        index_db = (environ.index_db_re
+                    if os.path.exists(environ.index_db_re)
+                    else environ.index_db)
+        try:
+            st = os.stat(index_db)
+        except OSError:
+            raise RuntimeError("can't find index.db")
+        stat = (index_db, st.st_ino, st.st_mtime, st.st_size)
+
+        with self.index_lock:
+            if stat != self.index_stat:
+                # The database lives as long as one connection to it is
+                # open, so keep one until the next reload.
+                self.generation += 1
+                uri = ('file:cppman-index-%d?mode=memory&cache=shared'
+                       % self.generation)
+                conn = sqlite3.connect(uri, uri=True,
+                                       check_same_thread=False)
+                disk = sqlite3.connect(index_db)
+                try:
+                    disk.backup(conn)
+                finally:
+                    disk.close()
+                if self.index_conn is not None:
+                    self.index_conn.close()
+                self.index_conn = conn
+                self.index_uri = uri
+                self.index_stat = stat
+            return self.index_uri
+
+    def _stores(self):
+        """Return a Cppman holding the archive of cached pages and the store
+        of fetched HTML shared by all lookups"""
+        with self.stores_lock:
+            if self.stores is None:
+                stores = Cppman()
+                stores._page_store()
+                stores._html_store()
+                self.stores = stores
+            return self.stores
+
+    def _render(self, page, columns, locale):
+        """Render the gzipped page as plain text like `pager.sh pipe' does,
+        without running groff."""
+        key = (page, columns, tuple(locale))
+        with self.pages_lock:
+            if key in self.pages:
+                self.pages.move_to_end(key)
+                return self.pages[key]
+
+        text = plain_text(page, columns, util.get_device(locale))
+
+        with self.pages_lock:
+            self.pages[key] = text
+            while len(self.pages) > RENDER_CACHE_SIZE:
+                self.pages.popitem(last=False)
+        return text
+
+    def lookup(self, request):
+        cm = DaemonCppman(self._load_index(), self._stores(),
+                          forced=request['forced'])
+        if request['source'] in environ.config.SOURCES:
+            cm.source = request['source']
+
+        entry = cm.fuzzy_find(request['pattern'], 1)
+        page = cm.get_cached_page(entry)
+
+        title, keyword, url = entry
+        response = {'title': title, 'keyword': keyword, 'url': url,
+                    'page': base64.b64encode(page).decode('ascii')}
+        if request['render']:
+            response['text'] = self._render(page, request['columns'],
+                                            request['locale'])
+        return response
+
+
+def serve():
+    """Serve lookups on environ.daemon_socket until interrupted."""
+    path = environ.daemon_socket
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        pass
+    else:
+        raise RuntimeError('a cppman daemon is already serving on %s' % path)
+    finally:
+        probe.close()
+
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+    # Only the owner may talk to the daemon
+    umask = os.umask(0o177)
+    try:
+        server = Server(path)
+    finally:
+        os.umask(umask)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print('Serving lookups on %s ...' % path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
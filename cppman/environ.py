@@ -48,10 +48,33 @@ except:
     pass
 
 index_db_re = os.path.join(cache_dir, 'index.db')
+rebuild_dir = os.path.join(cache_dir, 'rebuild')
+html_dir = os.path.join(cache_dir, 'html')
+render_db = os.path.join(cache_dir, 'rendered.db')
+
+# Directory of the pages cached for all users of the host, if any; an empty
+# CPPMAN_SHARED_CACHE keeps the pages in the cache of the user
+if 'CPPMAN_SHARED_CACHE' in os.environ:
+    shared_cache_dir = os.environ['CPPMAN_SHARED_CACHE']
+else:
+    shared_cache_dir = config.SharedCache
+page_dir = shared_cache_dir or cache_dir
+page_db = os.path.join(page_dir, 'pages.db')
+# Archive of the user, also used when the shared one cannot be created
+user_page_db = os.path.join(cache_dir, 'pages.db')
 
 index_db = index_db_re if os.path.exists(index_db_re) \
     else get_lib_path('index.db')
 
+daemon_socket = os.path.join(os.getenv("XDG_RUNTIME_DIR", cache_dir),
+                             'cppman.sock')
+
+# Bytes the archive of cached pages may take, 0 for no limit
+try:
+    cache_size = int(config.CacheSize) * 1024 * 1024
+except ValueError:
+    cache_size = 0
+
 pager = config.Pager
 pager_config = get_lib_path('cppman.vim')
 pager_script = get_lib_path('pager.sh')
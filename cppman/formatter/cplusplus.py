@@ -28,6 +28,10 @@ import re
 from cppman.formatter.tableparser import parse_table
 from cppman.util import fixupHTML, html2man, urlopen
 
+# Version of the output of html2groff, bump it when the output changes so
+# that 'cppman --reformat-cache' formats the cached pages again
+FORMAT_VERSION = 1
+
 # Format replacement RE list
 # The '.SE' pseudo macro is described in the function: html2groff
 pre_rps = [
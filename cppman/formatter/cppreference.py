@@ -30,6 +30,10 @@ from functools import partial
 from cppman.formatter.tableparser import parse_table
 from cppman.util import fixupHTML, html2man, urlopen
 
+# Version of the output of html2groff, bump it when the output changes so
+# that 'cppman --reformat-cache' formats the cached pages again
+FORMAT_VERSION = 1
+
 
 def member_table_def(g):
     tbl = parse_table('<table>%s</table>' % str(g.group(3)))
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# htmlstore.py - On-disk store of fetched HTML pages
+#
+# Copyright (C) 2010 - 2016  Wei-Ning Huang (AZ) <aitjcize@gmail.com>
+# All Rights reserved.
+#
+# This file is part of cppman.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from cppman import util
+
+# Seconds a stored page is used without fetching it again
+MAX_AGE = 24 * 60 * 60
+
+
+def content_hash(body):
+    """Return the hash body is stored under"""
+    return hashlib.sha1(body).hexdigest()
+
+
+class HTMLStore(object):
+    """Compressed HTML pages as fetched from the sources.
+
+    The content of a page is stored once per SHA-1 hash under objects/, and
+    pages.db maps each URL to its hash and the metadata of its last fetch.
+    The store is shared by the threads of a crawl and by other processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(path, 'pages.db'),
+                                     timeout=30, check_same_thread=False)
+        # Readers do not block the writer, and a lost page is fetched again
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'url VARCHAR(255) NOT NULL PRIMARY KEY, '
+            'hash VARCHAR(40) NOT NULL, '
+            'content_type VARCHAR(255), '
+            'etag VARCHAR(255), '
+            'last_modified VARCHAR(255), '
+            'fetched REAL NOT NULL'
+            ')')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS pages_hash ON pages(hash)')
+        self._conn.commit()
+
+    def _object_path(self, hash):
+        return os.path.join(self.path, 'objects', hash[:2], hash[2:] + '.gz')
+
+    def response(self, url, max_age=MAX_AGE):
+        """Return the stored page of url as a util.Response, None if there
+        is none fetched in the last max_age seconds."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT hash, content_type, etag, last_modified, fetched '
+                'FROM pages WHERE url = ?', (url,)).fetchone()
+        if row is None or time.time() - row[4] > max_age:
+            return None
+        hash, content_type, etag, last_modified, _ = row
+
+        body = self.content(hash)
+        if body is None:
+            return None
+
+        headers = {'Content-Type': content_type}
+        if etag:
+            headers['ETag'] = etag
+        if last_modified:
+            headers['Last-Modified'] = last_modified
+        return util.Response(url, 200, 'OK', headers, body)
+
+    def has(self, hash):
+        """Whether a page with the content hash is stored"""
+        return os.path.exists(self._object_path(hash))
+
+    def content(self, hash):
+        """Return the stored page with the content hash, None if there is
+        none"""
+        try:
+            with gzip.open(self._object_path(hash)) as f:
+                return f.read()
+        except (IOError, EOFError):
+            # Removed or truncated
+            return None
+
+    def put(self, url, res):
+        """Store the response res of url if it is an HTML page"""
+        content_type = res.getheader('Content-Type') or ''
+        if res.status != 200 or 'text/html' not in content_type:
+            return
+
+        body = res.read()
+        hash = content_hash(body)
+        path = self._object_path(hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = '%s.%d.%d' % (path, os.getpid(), threading.get_ident())
+            with open(tmp_path, 'wb') as f:
+                f.write(gzip.compress(body))
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            row = self._conn.execute('SELECT hash FROM pages WHERE url = ?',
+                                     (url,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO pages (url, hash, content_type, etag, '
+                'last_modified, fetched) VALUES (?, ?, ?, ?, ?, ?)',
+                (url, hash, content_type, res.getheader('ETag'),
+                 res.getheader('Last-Modified'), time.time()))
+            self._conn.commit()
+            # Drop the previous content unless another page has it
+            if row is not None and row[0] != hash and not self._conn.execute(
+                    'SELECT 1 FROM pages WHERE hash = ?', row).fetchone():
+                try:
+                    os.remove(self._object_path(row[0]))
+                except OSError:
+                    pass
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# keywordindex.py - In-memory index of the keywords of a rebuilt index
+#
+# Copyright (C) 2010 - 2016  Wei-Ning Huang (AZ) <aitjcize@gmail.com>
+# All Rights reserved.
+#
+# This file is part of cppman.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import collections
+import re
+
+# SQLite's LIKE ignores the case of ASCII letters only
+_ASCII_LOWER = {c: c + 32 for c in range(ord('A'), ord('Z') + 1)}
+
+
+class KeywordIndex(object):
+    """ Keywords of the index being built, in insertion order.
+
+        find(k) returns the keywords that the former alias query matched
+        with keyword LIKE "%::k::%", "k::%", "k", "k %", "k)%" or "k,%".
+        Every keyword is indexed by its substrings that start at the
+        beginning or after a '::' and end before a '::', ' ', ')', ',' or
+        at the end, so each alias is resolved with a dictionary lookup
+        instead of a scan. As with LIKE, letters are compared ASCII
+        case-insensitively and '_' in k matches any character.
+    """
+
+    def __init__(self):
+        self.rows = []
+        # length -> [(substring, row)]
+        self._substrings = collections.defaultdict(list)
+        # length -> positions of '_' -> substring masked at them -> [row]
+        self._lookups = collections.defaultdict(dict)
+
+    @staticmethod
+    def _mask(string, positions):
+        if not positions:
+            return string
+        chars = list(string)
+        for i in positions:
+            chars[i] = '_'
+        return ''.join(chars)
+
+    def add(self, id, keyword):
+        row = len(self.rows)
+        self.rows.append((id, keyword))
+
+        keyword = keyword.translate(_ASCII_LOWER)
+        colons = [i for i in range(len(keyword) - 1)
+                  if keyword[i:i + 2] == '::']
+        spans = {(0, e) for e in colons}
+        spans.add((0, len(keyword)))
+        spans.update((0, e) for e, c in enumerate(keyword) if c in ' ),')
+        spans.update((s + 2, e) for s in colons for e in colons if e >= s + 2)
+
+        for s, e in spans:
+            substring = keyword[s:e]
+            self._substrings[e - s].append((substring, row))
+            for positions, lookup in self._lookups[e - s].items():
+                lookup.setdefault(self._mask(substring, positions),
+                                  []).append(row)
+
+    def find(self, k):
+        k = k.translate(_ASCII_LOWER)
+        if '%' in k:
+            return self._scan(k)
+
+        positions = tuple(i for i, c in enumerate(k) if c == '_')
+        lookup = self._lookups[len(k)].get(positions)
+        if lookup is None:
+            lookup = self._lookups[len(k)][positions] = {}
+            for substring, row in self._substrings[len(k)]:
+                lookup.setdefault(self._mask(substring, positions),
+                                  []).append(row)
+        return [self.rows[row] for row in sorted(set(lookup.get(k, ())))]
+
+    def _scan(self, k):
+        """ Match all keywords, for patterns of any length """
+        k = ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c)
+                    for c in k)
+        pattern = re.compile(r'.*::%s::.*|%s(?:::.*| .*|\).*|,.*)?' % (k, k),
+                             re.DOTALL)
+        return [(id, keyword) for id, keyword in self.rows
+                if pattern.fullmatch(keyword.translate(_ASCII_LOWER))]
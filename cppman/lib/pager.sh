@@ -24,7 +24,8 @@
 
 # Script arguments:
 #   $1: pager type
-#   $2: page path
+#   $2: path of the gzipped page, - if standard input holds the page as
+#       rendered by groff
 #   $3: column
 #   $4: vim config
 #   $5: page name
@@ -50,8 +51,12 @@ vim_config=$4
 page_name=$5
 
 render() {
-  gunzip -c "$page_path" | \
-    groff -t -c -m man -T$output_dev -rLL=${col}n -rLT=${col}n 2>/dev/null
+  if [ "$page_path" = "-" ]; then
+    cat
+  else
+    gunzip -c "$page_path" | \
+      groff -t -c -m man -T$output_dev -rLL=${col}n -rLT=${col}n 2>/dev/null
+  fi
 }
 
 remove_escape() {
@@ -59,7 +64,7 @@ remove_escape() {
     sed "s/$escape\[[^m]*m//g" | col -x -b
 }
 
-if [ -z "$(which groff)" ]; then
+if [ "$page_path" != "-" ] && [ -z "$(which groff)" ]; then
   echo "error: groff not found, please install the groff command"
   exit 1
 fi
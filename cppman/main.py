@@ -23,22 +23,46 @@
 #
 
 import collections
-import gzip
-import html
 import importlib
+import itertools
 import os
 import os.path
 import re
 import shutil
 import sqlite3
-import subprocess
 import sys
+import threading
+import time
 
-from bs4 import BeautifulSoup
-from cppman import environ, util
+from cppman import environ, pageformat, util
 from cppman.crawler import Crawler
+from cppman.progress import Progress
 from urllib.parse import urlparse, unquote
 
+# Seconds between two checkpoints of the crawl state during rebuild_index
+CHECKPOINT_INTERVAL = 30
+
+# Index tables and where their pages are crawled from
+SOURCES = collections.OrderedDict([
+    ('cplusplus.com', ('https://cplusplus.com/reference/', None)),
+    ('cppreference.com', ('https://en.cppreference.com/w/cpp', '/w/cpp')),
+])
+
+# Attempts of a search while the index database is being replaced, and the
+# seconds between them
+SEARCH_RETRIES = 3
+SEARCH_RETRY_DELAY = 0.1
+
+# Default requests per second to the same host while caching pages,
+# attempts to cache a page and the seconds before the first retry, doubled
+# after each
+CACHE_RATE = 10
+CACHE_RETRIES = 3
+CACHE_BACKOFF = 1
+
+# Pages buffered by process_document before they are written to the
+# staging database
+STAGING_BATCH = 100
 
 
 def _sort_crawl(entry):
@@ -65,33 +89,6 @@ def _sort_crawl(entry):
     return (hasStd1, hasStd2, keyword, title)
 
 
-def _sort_search(entry, pattern):
-    """ Sort results
-        0. exact match goes first
-        1. sort by 'std::' (an entry with `std::` goes before an entry without)
-        2. sort by which position the keyword appears
-    """
-
-    title, keyword, url = entry
-
-    if keyword == pattern:
-        # Exact match - lowest key value
-        return (-1, -1, 0, keyword)
-
-    hasStd1 = keyword.find("std::")
-    if hasStd1 == -1:
-        hasStd1 = 1
-    else:
-        hasStd1 = 0
-
-    hasStd2 = title.find("std::")
-    if hasStd2 == -1:
-        hasStd2 = 1
-    else:
-        hasStd2 = 0
-
-    return (hasStd1, hasStd2, keyword.find(pattern), keyword)
-
 # Return the longest prefix of all list elements.
 def _commonprefix(s1, s2):
     """" Given two strings, returns the longest common leading prefix """
@@ -113,6 +110,16 @@ def _removesuffix(string, suffix):
         return string[:-len(suffix)]
     return string
 
+def _glob_escape(string):
+    """ Escape GLOB wildcards so that string is matched literally """
+    return re.sub(r'([*?\[\]])', r'[\1]', string)
+
+def _like_escape(string):
+    """ Escape LIKE wildcards so that string is matched literally, with
+        ESCAPE '\\' """
+    return re.sub(r'([\\%_])', r'\\\1', string)
+
+
 class Cppman(Crawler):
     """ Manage cpp man pages, indexes. """
 
@@ -122,138 +129,545 @@ class Cppman(Crawler):
         self.success_count = None
         self.failure_count = None
         self.force_columns = force_columns
+        self.source = environ.source
+        # (url, title, keywords, aliases, validators) of the pages not yet
+        # written to the staging database. validators is (etag,
+        # last_modified, hash), title is None if only the validators of the
+        # page changed and validators is None if the page is gone.
+        self.pending_results = []
+        self.results_lock = threading.Lock()
+        self.staging_conn = None
+        # url -> validators of the pages of the previous crawl
+        self.validators = {}
+        # Whether the crawl refreshes the pages of the previous crawl. Only
+        # then are its requests conditional and unchanged pages skipped, the
+        # staging database of a resumed crawl may hold pages whose links
+        # were not crawled yet.
+        self.refreshing = False
+        # Whether a rebuild uses the pages fetched in the last
+        # htmlstore.MAX_AGE seconds instead of downloading them again
+        self.reuse_html = False
+        # number of pages indexed, unchanged and removed by the crawl
+        self.page_counts = collections.Counter()
+        self.checkpoint_file = None
+        self.crawling = False
+        self.rate_limiter = util.RateLimiter(CACHE_RATE)
+        self.page_store = None
+        self.render_cache = None
+        # terminal widths cache_all renders the pages at
+        self.prerender_columns = []
+
+    def set_rate_limit(self, rate):
+        """ Send at most rate requests per second to the same host while
+            caching pages, 0 for no limit.
+        """
+        self.rate_limiter = util.RateLimiter(rate)
+
+    def set_reuse_html(self, reuse):
+        """ Let rebuild_index use the pages fetched recently, e.g. by an
+            earlier rebuild, instead of downloading them again.
+        """
+        self.reuse_html = reuse
+
+    def set_prerender(self, columns):
+        """ Render the pages cached by cache_all at each width in columns
+            ahead of time.
+        """
+        self.prerender_columns = list(columns)
 
-    def rebuild_index(self):
-        """ Rebuild index database from cplusplus.com and cppreference.com. """
+    def rebuild_index(self, sources=None, resume=False, refresh=False):
+        """ Rebuild index database from cplusplus.com and cppreference.com,
+            or from the given sources only.
 
-        self.db_conn = sqlite3.connect(environ.index_db_re)
-        self.db_cursor = self.db_conn.cursor()
+            Several sources are crawled concurrently, each by its own Cppman
+            instance. The crawl state is checkpointed to environ.rebuild_dir,
+            if resume is True crawling continues from the last checkpoint.
+            If refresh is True, the pages of the last crawl are requested
+            conditionally and only the pages that changed are indexed again.
+
+            The tables are written to a copy of the index database, which
+            replaces the index once all sources are written and verified.
+            Lookups use the previous index until then.
+        """
+        sources = sources or list(SOURCES)
+        for source in sources:
+            if source not in SOURCES:
+                raise RuntimeError('invalid source %s.' % source)
+
+        os.makedirs(environ.rebuild_dir, exist_ok=True)
+        # Rebuilds share the copy of the index and the crawl state, a second
+        # one waits for the running one to finish
+        with util.file_lock(os.path.join(environ.rebuild_dir, 'lock')):
+            if not resume:
+                for source in sources:
+                    self._remove_checkpoints(source)
+            new_index = environ.index_db_re + '.new'
+            self._copy_index(new_index)
+
+            if len(sources) == 1:
+                crawlers = [self]
+            else:
+                crawlers = []
+                for source in sources:
+                    cm = Cppman(self.forced, self.force_columns)
+                    cm.set_engine(self.engine)
+                    cm.set_concurrency_level(self.max_outstanding)
+                    cm.set_per_host_limit(self.max_per_host)
+                    cm.set_reuse_html(self.reuse_html)
+                    cm.set_max_depth(self.max_depth)
+                    crawlers.append(cm)
+
+            # Crawls overlap, writes to the index database take turns
+            write_lock = threading.Lock()
+            complete = [False] * len(sources)
+            errors = []
+
+            def rebuild(i):
+                try:
+                    complete[i] = crawlers[i]._rebuild_source(
+                        sources[i], resume, refresh, new_index, write_lock)
+                except Exception as e:
+                    errors.append(e)
+
+            try:
+                if len(sources) == 1:
+                    complete[0] = self._rebuild_source(
+                        sources[0], resume, refresh, new_index, write_lock)
+                else:
+                    threads = [threading.Thread(target=rebuild, args=(i,))
+                               for i in range(len(sources))]
+                    for t in threads:
+                        t.daemon = True
+                        t.start()
+                    for t in threads:
+                        # A timeout keeps the main thread responsive to Ctrl-C
+                        while t.is_alive():
+                            t.join(1)
+                    if errors:
+                        raise errors[0]
+            except (KeyboardInterrupt, SystemExit):
+                for cm in crawlers:
+                    if cm.crawling:
+                        with cm.checkpoint_lock:
+                            cm.checkpoint()
+                print("Crawl state saved, run 'cppman --rebuild-index "
+                      "--resume' to continue.")
+                raise
+
+            self._verify_index(new_index, sources)
+            # Readers have either the old or the new file open, never a mix
+            os.replace(new_index, environ.index_db_re)
+
+            if all(complete):
+                for source in sources:
+                    self._remove_checkpoints(source)
+
+    def _rebuild_source(self, table, resume, refresh, index_db, write_lock):
+        """ Crawl source table, continue its last crawl or refresh the pages
+            of the last crawl, and replace its tables in the database
+            index_db. Returns False if some URLs failed.
+        """
+        url, path = SOURCES[table]
+
+        self.add_url_filter(r'\.(jpg|jpeg|gif|png|js|css|swf|svg)$')
+        self.set_follow_mode(Crawler.F_SAME_PATH)
+        self.set_checkpoint_interval(CHECKPOINT_INTERVAL)
+        # The pages fetched by an interrupted crawl are used to continue it,
+        # other crawls download the current pages unless asked not to
+        from cppman import htmlstore
+        reuse = (resume or self.reuse_html) and not refresh and not self.forced
+        self.set_html_store(self._html_store(),
+                            htmlstore.MAX_AGE if reuse else 0)
+
+        self.checkpoint_file = os.path.join(environ.rebuild_dir,
+                                            '%s.json' % table)
+        checkpoint = self._load_checkpoint() if resume else None
+        staging_db = os.path.join(environ.rebuild_dir, '%s.db' % table)
+        if refresh and checkpoint is None and not os.path.exists(staging_db):
+            print("No previous crawl of %s, crawling all pages" % table)
+            refresh = False
+        self._open_staging(staging_db, keep=checkpoint is not None or refresh)
+        self.refreshing = refresh
+        self._load_validators()
+        self.page_counts.clear()
         try:
-            self.add_url_filter(r'\.(jpg|jpeg|gif|png|js|css|swf|svg)$')
-            self.set_follow_mode(Crawler.F_SAME_PATH)
-
-            sources = [('cplusplus.com', 'https://cplusplus.com/reference/', None),
-                       ('cppreference.com', 'https://en.cppreference.com/w/cpp', '/w/cpp')]
-
-            for table, url, path in sources:
-                """ Drop and recreate tables. """
-                self.db_cursor.execute(
-                    'DROP TABLE IF EXISTS "%s"'
-                    % table)
-
-                self.db_cursor.execute(
-                    'DROP TABLE IF EXISTS "%s_keywords"'
-                    % table)
-
-                self.db_cursor.execute(
-                    'CREATE TABLE "%s" ('
-                    'id INTEGER NOT NULL PRIMARY KEY, '
-                    'title VARCHAR(255) NOT NULL UNIQUE, '
-                    'url VARCHAR(255) NOT NULL UNIQUE'
-                    ')' % table)
-
-                self.db_cursor.execute(
-                    'CREATE TABLE "%s_keywords" ('
-                    'id INTEGER NOT NULL, '
-                    'keyword VARCHAR(255), '
-                    'FOREIGN KEY(id) REFERENCES "%s"(id)'
-                    ')' % (table, table))
-
-                """ Crawl and insert all entries. """
-                self.results = collections.defaultdict(list)
+            if checkpoint is None:
+                # Request all pages of the last crawl again when refreshing,
+                # the staging database is empty otherwise.
+                self.set_state({
+                    'targets': [(1, url) for url in self.validators],
+                    'queued': list(self.validators)})
+                if refresh:
+                    print("Refreshing %d pages of %s"
+                          % (len(self.validators), table))
+            elif checkpoint['done']:
+                print("Using the results of the last crawl of %s" % table)
+            else:
+                print("Resuming the last crawl of %s" % table)
+
+            if checkpoint is None or not checkpoint['done']:
+                self.crawling = True
                 self.crawl(url)
-                results = self._results_with_unique_title()
-
-                for title in results:
-                    """ 1. insert title """
-                    self.db_cursor.execute(
-                        'INSERT INTO "%s" (title, url) VALUES (?, ?)'
-                        % table, (title, results[title]["url"]))
-
-                    lastRow = self.db_cursor.execute(
-                        'SELECT last_insert_rowid()').fetchall()[0][0]
-
-                    """ 2. insert all keywords """
-                    for k in results[title]["keywords"]:
-                        self.db_cursor.execute(
-                            'INSERT INTO "%s_keywords" (id, keyword) '
-                            'VALUES (?, ?)'
-                            % table, (lastRow, k))
-
-                """ 3. add all aliases """
-                for title in results:
-                    for (k, a) in results[title]["aliases"]:
-                        """ search for combinations of words
-
-                            e.g. std::basic_string::append
-                        """
-                        sql_results = self.db_cursor.execute(
-                            'SELECT id, keyword FROM "%s_keywords" '
-                            'WHERE keyword LIKE "%%::%s::%%" '
-                            'OR keyword LIKE "%s::%%" '
-                            'OR keyword LIKE "%s" '
-                            'OR keyword LIKE "%s %%" '
-                            'OR keyword LIKE "%s)%%" '
-                            'OR keyword LIKE "%s,%%"'
-                            % (table, k, k, k, k, k, k)).fetchall()
-
-                        for id, keyword in sql_results:
-                            keyword = re.sub(re.escape("%s" % k), "%s" % a, keyword, flags=re.IGNORECASE)
-
-                            self.db_cursor.execute(
-                                'INSERT INTO "%s_keywords" (id, keyword) '
-                                'VALUES (?, ?)'
-                                % table, (id, keyword))
-
-                self.db_conn.commit()
-
-                """ remove duplicate keywords that link the same page """
-                self.db_cursor.execute(
-                    'DELETE FROM "%s_keywords" WHERE rowid NOT IN ('
-                    'SELECT min(rowid) FROM "%s_keywords" '
-                    'GROUP BY id, keyword '
-                    ')' % (table, table)).fetchall()
-
-                """ give duplicate keywords with different links entry numbers """
-                results = self.db_cursor.execute(
-                    'SELECT t3.id, t3.title, t2.keyword, t1.count '
-                    'FROM ('
-                    '      SELECT keyword, COUNT(*) AS count FROM "%s_keywords" '
-                    '      GROUP BY keyword HAVING count > 1) AS t1 '
-                    'JOIN "%s_keywords" AS t2 '
-                    'JOIN "%s" AS t3 '
-                    'WHERE t1.keyword = t2.keyword AND t3.id = t2.id '
-                    'ORDER BY t2.keyword, t3.title'
-                    % (table, table, table)).fetchall()
-
-                keywords = {}
-                results = sorted(results, key=_sort_crawl)
-                for id, title, keyword, count in results:
-                    if not keyword in keywords:
-                        keywords[keyword] = 0
-                    keywords[keyword] += 1
-                    new_keyword = "%s (%s)" % (keyword, keywords[keyword])
-                    self.db_cursor.execute(
-                        'UPDATE "%s_keywords" SET keyword=? WHERE '
-                        'id=? AND keyword=?'
-                        % table, (new_keyword, id, keyword))
-
-                self.db_conn.commit()
-
-        except KeyboardInterrupt:
-            os.remove(environ.index_db_re)
-            raise KeyboardInterrupt
+                self.crawling = False
+                print("=== %s: %d pages indexed, %d unchanged, %d removed"
+                      % (table, self.page_counts['indexed'],
+                         self.page_counts['unchanged'],
+                         self.page_counts['removed']))
+
+            done = not self.failed_targets
+            with self.checkpoint_lock:
+                self.checkpoint(done)
+            if not done:
+                print("Run 'cppman --rebuild-index --resume' to retry the "
+                      "failed URLs of %s." % table)
+
+            with write_lock:
+                self.db_conn = sqlite3.connect(index_db)
+                self.db_cursor = self.db_conn.cursor()
+                try:
+                    self._write_index(table)
+                finally:
+                    # An unfinished transaction is rolled back, the previous
+                    # tables of the source are kept.
+                    self.db_conn.close()
+            return done
+        finally:
+            if not self.crawling:
+                self.staging_conn.close()
+                self.staging_conn = None
+                self.html_store.close()
+                self.html_store = None
+
+    def _copy_index(self, path):
+        """ Create the database at path as a copy of the current index, the
+            tables of the sources that are not rebuilt are kept from it.
+        """
+        for name in (path, path + '-journal'):
+            if os.path.exists(name):
+                os.remove(name)
+
+        conn = sqlite3.connect(path)
+        try:
+            if os.path.exists(environ.index_db):
+                index = sqlite3.connect(environ.index_db)
+                try:
+                    index.backup(conn)
+                finally:
+                    index.close()
         finally:
-            self.db_conn.close()
+            conn.close()
+
+    def _verify_index(self, path, sources):
+        """ Check the rebuilt index at path before it replaces the current
+            one, raises RuntimeError if it is damaged or a source is empty.
+        """
+        conn = sqlite3.connect(path)
+        try:
+            result, = conn.execute('PRAGMA quick_check').fetchone()
+            if result != 'ok':
+                raise RuntimeError('rebuilt index is damaged: %s' % result)
+            for source in sources:
+                for table in (source, '%s_keywords' % source):
+                    count, = conn.execute(
+                        'SELECT COUNT(*) FROM "%s"' % table).fetchone()
+                    if count == 0:
+                        raise RuntimeError(
+                            'rebuilt index has no entries in %s, the '
+                            'previous index is kept' % table)
+        finally:
+            conn.close()
+
+    def _open_staging(self, path, keep=False):
+        """ Open the staging database at path that collects the results of
+            process_document, its content is dropped unless keep is True.
+        """
+        if not keep:
+            for name in (path, path + '-journal'):
+                if os.path.exists(name):
+                    os.remove(name)
+
+        # process_document runs in the crawler threads
+        self.staging_conn = sqlite3.connect(path, check_same_thread=False)
+        self.pending_results = []
+        self.staging_conn.executescript(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'id INTEGER NOT NULL PRIMARY KEY, '
+            'url VARCHAR(255) NOT NULL UNIQUE, '
+            'title VARCHAR(255) NOT NULL, '
+            'etag VARCHAR(255), '
+            'last_modified VARCHAR(255), '
+            'hash VARCHAR(40)'
+            ');'
+            'CREATE INDEX IF NOT EXISTS pages_title ON pages(title);'
+            'CREATE TABLE IF NOT EXISTS keywords ('
+            'page INTEGER NOT NULL, '
+            'keyword VARCHAR(255) NOT NULL'
+            ');'
+            'CREATE INDEX IF NOT EXISTS keywords_page ON keywords(page);'
+            'CREATE TABLE IF NOT EXISTS aliases ('
+            'page INTEGER NOT NULL, '
+            'name VARCHAR(255) NOT NULL, '
+            'alias VARCHAR(255) NOT NULL'
+            ');'
+            'CREATE INDEX IF NOT EXISTS aliases_page ON aliases(page);')
+
+    def _flush_results(self):
+        """ Write the pending results to the staging database, the caller
+            holds results_lock.
+        """
+        for url, title, keywords, aliases, validators in self.pending_results:
+            row = self.staging_conn.execute(
+                'SELECT id FROM pages WHERE url = ?', (url,)).fetchone()
+            if validators is None:
+                if row is not None:
+                    self._delete_staged_page(row[0])
+                continue
+            if title is None:
+                self.staging_conn.execute(
+                    'UPDATE pages SET etag = ?, last_modified = ?, hash = ? '
+                    'WHERE url = ?', validators + (url,))
+                continue
+
+            if row is None:
+                page = self.staging_conn.execute(
+                    'INSERT INTO pages (url, title, etag, last_modified, hash) '
+                    'VALUES (?, ?, ?, ?, ?)', (url, title) + validators
+                ).lastrowid
+            else:
+                # The page changed since the last crawl, or a resumed crawl
+                # fetched it again. It keeps its id, and so its position.
+                page = row[0]
+                self._delete_staged_page(page, keep_page=True)
+                self.staging_conn.execute(
+                    'UPDATE pages SET title = ?, etag = ?, last_modified = ?, '
+                    'hash = ? WHERE id = ?', (title,) + validators + (page,))
+            self.staging_conn.executemany(
+                'INSERT INTO keywords (page, keyword) VALUES (?, ?)',
+                ((page, k) for k in keywords))
+            self.staging_conn.executemany(
+                'INSERT INTO aliases (page, name, alias) VALUES (?, ?, ?)',
+                ((page, n, k) for n, k in aliases))
+        self.staging_conn.commit()
+        self.pending_results = []
+
+    def _delete_staged_page(self, page, keep_page=False):
+        self.staging_conn.execute('DELETE FROM keywords WHERE page = ?',
+                                  (page,))
+        self.staging_conn.execute('DELETE FROM aliases WHERE page = ?',
+                                  (page,))
+        if not keep_page:
+            self.staging_conn.execute('DELETE FROM pages WHERE id = ?',
+                                      (page,))
+
+    def _load_validators(self):
+        """ Load the validators of the pages in the staging database, the
+            crawl sends conditional requests for these pages.
+        """
+        self.validators = {
+            url: (etag, last_modified, hash)
+            for url, etag, last_modified, hash in self.staging_conn.execute(
+                'SELECT url, etag, last_modified, hash FROM pages')}
+
+    def _write_index(self, table):
+        """ Replace the tables of source table with the results in the
+            staging database in one transaction.
+        """
+        from cppman.keywordindex import KeywordIndex
+
+        with self.results_lock:
+            self._flush_results()
+        results = self._results_with_unique_title()
+        titles = list(results)
+
+        self.db_cursor.execute('BEGIN')
+
+        """ 1. collect all keywords, the id of a title is its position """
+        index = KeywordIndex()
+        for id, title in enumerate(titles, 1):
+            for k, in self.staging_conn.execute(
+                    'SELECT keyword FROM keywords WHERE page = ? '
+                    'ORDER BY rowid', (results[title][0],)):
+                index.add(id, k)
+
+        """ 2. add all aliases """
+        for title in titles:
+            for (k, a) in self.staging_conn.execute(
+                    'SELECT name, alias FROM aliases WHERE page = ? '
+                    'ORDER BY rowid', (results[title][0],)):
+                """ search for combinations of words
+
+                    e.g. std::basic_string::append
+                """
+                for id, keyword in index.find(k):
+                    keyword = re.sub(re.escape("%s" % k), "%s" % a, keyword,
+                                     flags=re.IGNORECASE)
+                    index.add(id, keyword)
+
+        """ 3. remove duplicate keywords that link the same page """
+        keywords = {}
+        for id, keyword in index.rows:
+            if (id, keyword) not in keywords:
+                keywords[(id, keyword)] = [id, keyword]
+
+        """ 4. give duplicate keywords with different links entry numbers """
+        counts = collections.Counter(keyword for id, keyword in keywords)
+        duplicates = sorted(
+            ((id, titles[id - 1], keyword, counts[keyword])
+             for id, keyword in keywords if counts[keyword] > 1),
+            key=_sort_crawl)
+
+        numbers = collections.Counter()
+        for id, title, keyword, count in duplicates:
+            numbers[keyword] += 1
+            keywords[(id, keyword)][1] = "%s (%s)" % (keyword, numbers[keyword])
+
+        """ 5. write the tables """
+        self.db_cursor.execute('DROP TABLE IF EXISTS "%s"' % table)
+        self.db_cursor.execute('DROP TABLE IF EXISTS "%s_keywords"' % table)
+
+        self.db_cursor.execute(
+            'CREATE TABLE "%s" ('
+            'id INTEGER NOT NULL PRIMARY KEY, '
+            'title VARCHAR(255) NOT NULL UNIQUE, '
+            'url VARCHAR(255) NOT NULL UNIQUE, '
+            'has_std INTEGER NOT NULL DEFAULT 0'
+            ')' % table)
+
+        self.db_cursor.execute(
+            'CREATE TABLE "%s_keywords" ('
+            'id INTEGER NOT NULL, '
+            'keyword VARCHAR(255), '
+            'has_std INTEGER NOT NULL DEFAULT 0, '
+            'FOREIGN KEY(id) REFERENCES "%s"(id)'
+            ')' % (table, table))
+
+        # has_std stores the inputs of the search ranking
+        self.db_cursor.executemany(
+            'INSERT INTO "%s" (id, title, url, has_std) VALUES (?, ?, ?, ?)'
+            % table,
+            ((id, title, results[title][1], 'std::' in title)
+             for id, title in enumerate(titles, 1)))
+        self.db_cursor.executemany(
+            'INSERT INTO "%s_keywords" (id, keyword, has_std) '
+            'VALUES (?, ?, ?)' % table,
+            ((id, keyword, 'std::' in keyword)
+             for id, keyword in keywords.values()))
+
+        self.db_cursor.execute(
+            'CREATE INDEX "%s_keywords_keyword" '
+            'ON "%s_keywords"(keyword)' % (table, table))
+
+        """ build the substring index used by _search_keyword """
+        self.db_cursor.execute(
+            'DROP TABLE IF EXISTS "%s_keywords_fts"' % table)
+        try:
+            self.db_cursor.execute(
+                'CREATE VIRTUAL TABLE "%s_keywords_fts" USING fts5('
+                'keyword, content="%s_keywords", content_rowid="rowid", '
+                'tokenize="trigram case_sensitive 1")' % (table, table))
+            self.db_cursor.execute(
+                'INSERT INTO "%s_keywords_fts"("%s_keywords_fts") '
+                'VALUES (\'rebuild\')' % (table, table))
+        except sqlite3.OperationalError as e:
+            # SQLite without FTS5 or the trigram tokenizer (< 3.34),
+            # searching falls back to LIKE scans.
+            print("Can't build keyword index: %s" % e)
+
+        self.db_conn.commit()
+
+    def checkpoint(self, done=False):
+        """ Save the crawl state of the current source, done is True when the
+            crawl is finished. The results are kept in the staging database.
+        """
+        import json
+
+        state = self.get_state()
+        with self.results_lock:
+            self._flush_results()
+
+        tmp_file = self.checkpoint_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'done': done, 'crawl': state}, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def _load_checkpoint(self):
+        """ Restore the crawl state of the current source from its
+            checkpoint, returns None if there is none.
+        """
+        import json
 
-    def process_document(self, url, content, depth):
+        try:
+            with open(self.checkpoint_file) as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (IOError, ValueError) as e:
+            print("Can't load checkpoint %s: %s" % (self.checkpoint_file, e))
+            return None
+
+        self.set_state(checkpoint['crawl'])
+        return checkpoint
+
+    def _remove_checkpoints(self, table):
+        """ Remove the checkpoint of source table, its staging database is
+            kept for the next refresh.
+        """
+        for name in ('%s.json' % table, '%s.json.tmp' % table):
+            path = os.path.join(environ.rebuild_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def request_headers(self, url):
+        """ make the request of a page of the previous crawl conditional """
+        if not self.refreshing:
+            return {}
+        etag, last_modified, _ = self.validators.get(url, (None, None, None))
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def process_unmodified(self, url, depth):
+        """callback for a page that did not change since the last crawl"""
+        print("Unchanged '%s' (depth %s)" % (url, depth))
+        with self.results_lock:
+            self.page_counts['unchanged'] += 1
+
+    def process_gone(self, url, depth):
+        """callback to remove a page of the last crawl from the index"""
+        if url in self.validators:
+            print("Removing '%s' (depth %s)..." % (url, depth))
+            self._add_result((url, None, None, None, None), 'removed')
+
+    def _add_result(self, result, count):
+        with self.results_lock:
+            self.pending_results.append(result)
+            self.page_counts[count] += 1
+            if len(self.pending_results) >= STAGING_BATCH:
+                self._flush_results()
+
+    def process_document(self, url, content, depth, headers=None):
         """callback to insert index"""
+        import hashlib
+
+        headers = headers or {}
+        validators = (headers.get('ETag'), headers.get('Last-Modified'),
+                      hashlib.sha1(content.encode('utf-8')).hexdigest())
+        if self.refreshing and url in self.validators and \
+                self.validators[url][2] == validators[2]:
+            # The server ignored the conditional request, but the page is
+            # the same. Its links are known already.
+            print("Unchanged '%s' (depth %s)" % (url, depth))
+            self._add_result((url, None, None, None, validators), 'unchanged')
+            return False
+
         print("Indexing '%s' (depth %s)..." % (url, depth))
         name = self._extract_name(content).replace('\n', '')
         keywords = self._extract_keywords(content)
 
         entry = {'url': url, 'keywords': set(), 'aliases': set()}
-        self.results[name].append(entry)
 
         for n in self._parse_title(name):
             """ add as keyword """
@@ -282,18 +696,26 @@ class Cppman(Crawler):
                     entry["aliases"].add(
                         (n, k.replace('std::', '')))
 
+        self._add_result((url, name, list(entry["keywords"]),
+                          list(entry["aliases"]), validators), 'indexed')
         return True
 
     def _results_with_unique_title(self):
-        """process crawling results and return title -> entry dictionary;
+        """process crawling results and return title -> (page, url) dictionary;
            add part of the path to entries having the same title
         """
+        # Titles in the order they were first seen, then their pages in order
+        rows = self.staging_conn.execute(
+            'SELECT title, id, url FROM pages ORDER BY '
+            '(SELECT min(id) FROM pages AS p WHERE p.title = pages.title), id')
+
         results = dict()
-        for title, entries in self.results.items():
+        for title, entries in itertools.groupby(rows, lambda row: row[0]):
+            entries = [(page, url) for _, page, url in entries]
             if len(entries) == 1:
                 results[title] = entries[0]
             else:
-                paths = [_removesuffix(urlparse(entry['url'])[2], '/') for entry in entries]
+                paths = [_removesuffix(urlparse(url)[2], '/') for page, url in entries]
                 prefix = os.path.commonpath(paths)
                 if prefix:
                     prefix += '/'
@@ -310,6 +732,8 @@ class Cppman(Crawler):
 
     def _extract_name(self, data):
         """Extract man page name from web page."""
+        import html
+
         name = re.search('<[hH]1[^>]*>(.+?)</[hH]1>', data, re.DOTALL).group(1)
         name = re.sub(r'<([^>]+)>', r'', name)
         name = re.sub(r'&gt;', r'>', name)
@@ -384,6 +808,9 @@ class Cppman(Crawler):
             extract aliases like std::string, template specializations like std::atomic_bool
             and helper functions like std::is_same_v
         """
+        import html
+        from bs4 import BeautifulSoup
+
         soup = BeautifulSoup(text, "lxml")
         names = []
 
@@ -439,7 +866,12 @@ class Cppman(Crawler):
         return [html.unescape(n) for n in names]
 
     def cache_all(self):
-        """Cache all available man pages"""
+        """Cache all available man pages
+
+        Pages are cached by max_outstanding worker threads, a page that
+        fails is retried after an exponentially growing delay.
+        """
+        import queue
 
         respond = input(
             'By default, cppman fetches pages on-the-fly if corresponding '
@@ -455,9 +887,6 @@ class Cppman(Crawler):
         except:
             pass
 
-        self.success_count = 0
-        self.failure_count = 0
-
         if not os.path.exists(environ.index_db):
             raise RuntimeError("can't find index.db")
 
@@ -467,133 +896,571 @@ class Cppman(Crawler):
         source = environ.config.source
         print('Caching manpages from %s ...' % source)
         data = cursor.execute('SELECT title, url FROM "%s"' % source).fetchall()
+        conn.close()
 
+        pages = queue.Queue()
         for name, url in data:
-            print('Caching %s ...' % name)
-            retries = 3
-            while retries > 0:
+            pages.put((name, url))
+        progress = Progress(len(data))
+
+        # Formatting is CPU-bound, it runs in a process per core. At most
+        # a few pages wait for their formatter, when more are fetched the
+        # fetchers block.
+        formatters = os.cpu_count() or 1
+        pool = pageformat.format_pool(formatters)
+        formatted = queue.Queue(2 * formatters)
+        stop = threading.Event()
+        store = self._page_store()
+        # Opened before the fetchers share it
+        self._html_store()
+
+        def fetch():
+            while not stop.is_set():
+                try:
+                    name, url = pages.get_nowait()
+                except queue.Empty:
+                    return
+                # Skip if already exists, override if forced flag is true
+                if store.has(source, self.get_normalized_page_name(name)) \
+                        and not self.forced:
+                    progress.add(True)
+                    continue
+                data = self._fetch_with_retries(url, name, progress)
+                if data is None:
+                    progress.add(False)
+                    continue
+                try:
+                    future = pool.submit(pageformat.format_page, source, name, data)
+                except RuntimeError:
+                    # The pool is shut down after Ctrl-C
+                    return
+                formatted.put((name, data, future))
+
+        def write():
+            while True:
+                item = formatted.get()
+                if item is None:
+                    return
+                name, data, future = item
                 try:
-                    self.cache_man_page(source, url, name)
-                except Exception:
-                    print('Retrying ...')
-                    retries -= 1
+                    self._write_page(source, name, future.result(), data)
+                except Exception as e:
+                    progress.message('Error caching %s: %s' % (name, e))
+                    progress.add(False)
                 else:
-                    self.success_count += 1
-                    break
-            else:
-                print('Error caching %s ...' % name)
-                self.failure_count += 1
-
-        conn.close()
+                    progress.add(True)
+
+        writer = threading.Thread(target=write)
+        writer.daemon = True
+        writer.start()
+        fetchers = []
+        for _ in range(max(1, min(self.max_outstanding, len(data)))):
+            t = threading.Thread(target=fetch)
+            t.daemon = True
+            t.start()
+            fetchers.append(t)
 
-        print('\n%d manual pages cached successfully.' % self.success_count)
-        print('%d manual pages failed to cache.' % self.failure_count)
+        try:
+            for t in fetchers:
+                # A timeout keeps the main thread responsive to Ctrl-C
+                while t.is_alive():
+                    t.join(0.5)
+                    progress.refresh()
+            formatted.put(None)
+            while writer.is_alive():
+                writer.join(0.5)
+                progress.refresh()
+            progress.finish()
+
+            self.success_count = progress.succeeded
+            self.failure_count = progress.failed
+
+            print('\n%d manual pages cached successfully.'
+                  % self.success_count)
+            print('%d manual pages failed to cache.' % self.failure_count)
+
+            if self.prerender_columns:
+                self._prerender(source, pool, formatters)
+        except BaseException:
+            stop.set()
+            pool.shutdown(wait=False)
+            raise
+        pool.shutdown()
         self.update_mandb(False)
 
+    def _prerender(self, source, pool, workers):
+        """ Render the cached pages of source at prerender_columns for the
+            output device of the current locale
+        """
+        import concurrent.futures
+
+        store = self._page_store()
+        cache = self._render_cache()
+        device = util.get_device()
+        names = store.names(source)
+
+        print('Rendering %d manual pages at %s columns ...'
+              % (len(names), ', '.join(map(str, self.prerender_columns))))
+        progress = Progress(len(names) * len(self.prerender_columns))
+        futures = {}
+
+        def wait():
+            done, _ = concurrent.futures.wait(
+                futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name, page, columns = futures.pop(future)
+                try:
+                    cache.put(page, columns, device, future.result())
+                except Exception as e:
+                    progress.message('Error rendering %s: %s' % (name, e))
+                    progress.add(False)
+                else:
+                    progress.add(True)
+
+        for name in names:
+            page = store.get(source, name)
+            for columns in self.prerender_columns:
+                if cache.has(page, columns, device) and not self.forced:
+                    progress.add(True)
+                    continue
+                # At most a few rendered pages wait to be saved
+                while len(futures) >= 2 * workers:
+                    wait()
+                future = pool.submit(pageformat.render_page, page, columns, device)
+                futures[future] = (name, page, columns)
+        while futures:
+            wait()
+        progress.finish()
+        print('\n%d manual pages rendered successfully.' % progress.succeeded)
+        print('%d manual pages failed to render.' % progress.failed)
+
+    def _fetch_with_retries(self, url, name, progress):
+        """ fetch a page for cache_all, returns None if it failed """
+        import urllib.error
+
+        progress.note('Caching %s ...' % name)
+        delay = CACHE_BACKOFF
+        for attempt in range(CACHE_RETRIES):
+            if attempt:
+                progress.message('Retrying %s in %ds ...' % (name, delay))
+                time.sleep(delay)
+                delay *= 2
+            try:
+                return self._fetch_html(url)
+            except urllib.error.HTTPError as e:
+                # Only the server's rate limit passes with time
+                if 400 <= e.code < 500 and e.code != 429:
+                    break
+            except Exception:
+                continue
+        progress.message('Error caching %s ...' % name)
+        return None
+
     def cache_man_page(self, source, url, name):
-        """callback to cache new man page"""
+        """callback to cache new man page, returns the gzipped page"""
         # Skip if already exists, override if forced flag is true
-        outname = self.get_page_path(source, name)
-        if os.path.exists(outname) and not self.forced:
-            return
+        store = self._page_store()
+        normalized = self.get_normalized_page_name(name)
+        page = store.get(source, normalized)
+        if page is not None and not self.forced:
+            return page
+
+        with self._page_lock(source, normalized):
+            # Cached by another lookup while this one waited
+            cached = store.get(source, normalized)
+            if cached is not None and (not self.forced or cached != page):
+                return cached
+
+            data = self._fetch_html(url)
+            page = pageformat.format_page(source, name, data)
+            self._write_page(source, name, page, data)
+
+        # mandb users read the pages from the man3 directory
+        if environ.config.UpdateManPath:
+            outname = self.get_page_path(source, name)
+            try:
+                os.makedirs(os.path.dirname(outname))
+            except OSError:
+                pass
+            tmp_name = '%s.%d.%d' % (outname, os.getpid(),
+                                     threading.get_ident())
+            with open(tmp_name, 'wb') as f:
+                f.write(page)
+            os.replace(tmp_name, outname)
+        return page
+
+    def _page_lock(self, source, name):
+        """ Lock of the page name of source, held while it is cached so that
+            concurrent lookups of the page by other threads and processes,
+            also of other users of a shared cache, share a single fetch.
+        """
+        import hashlib
 
+        # Next to the archive the pages are cached in
+        lock_dir = os.path.join(
+            os.path.dirname(self._page_store().path), 'locks')
         try:
-            os.makedirs(os.path.join(environ.cache_dir, source))
+            util.makedirs_like_parent(lock_dir)
         except OSError:
             pass
+        key = hashlib.sha1(('%s/%s' % (source, name)).encode('utf-8'))
+        return util.file_lock(os.path.join(lock_dir,
+                                           key.hexdigest() + '.lock'))
+
+    def _html_store(self):
+        """ The store of fetched pages, opened on first use """
+        if self.html_store is None:
+            from cppman.htmlstore import HTMLStore
+            self.html_store = HTMLStore(environ.html_dir)
+        return self.html_store
+
+    def _fetch_html(self, url):
+        """ Return the HTML of url, from the store if it was fetched
+            recently, e.g. by the last rebuild of the index, unless forced.
+        """
+        from cppman import htmlstore
+
+        store = self._html_store()
+        res = store.response(url, 0 if self.forced else htmlstore.MAX_AGE)
+        if res is None:
+            self.rate_limiter.wait(url)
+            res = util.urlopen(url)
+            store.put(url, res)
+        return res.read()
+
+    def _page_store(self):
+        """ The archive of cached pages, opened on first use. A new archive
+            takes over the pages cached by older versions of cppman. The
+            archive of the user is used when a shared one does not exist and
+            cannot be created.
+        """
+        if self.page_store is None:
+            from cppman.pagestore import PageStore
+            try:
+                store = PageStore(environ.page_db, environ.cache_size)
+            except OSError:
+                if environ.page_db == environ.user_page_db:
+                    raise
+                store = PageStore(environ.user_page_db, environ.cache_size)
+            if store.created:
+                for source in SOURCES:
+                    store.import_files(
+                        source, os.path.join(environ.cache_dir, source),
+                        os.path.join(environ.html_dir, source))
+            self.page_store = store
+        return self.page_store
+
+    def _render_cache(self):
+        """ The cache of rendered pages, opened on first use """
+        if self.render_cache is None:
+            from cppman.pagestore import RenderCache
+            self.render_cache = RenderCache(environ.render_db)
+        return self.render_cache
+
+    def render_page(self, page, columns, device=None):
+        """ Return the output of groff for the gzipped page at columns for
+            device, the device of the current locale by default.
+        """
+        if device is None:
+            device = util.get_device()
+        cache = self._render_cache()
+        text = cache.get(page, columns, device)
+        if text is None:
+            text = pageformat.render_page(page, columns, device)
+            cache.put(page, columns, device, text)
+        return text
+
+    def _write_page(self, source, name, page, html):
+        """ Save the formatted page and, for reformat_cache, the hash of its
+            HTML in the store of fetched pages
+        """
+        from cppman import htmlstore
+
+        self._page_store().put(source, self.get_normalized_page_name(name),
+                               page, htmlstore.content_hash(html))
+
+    def reformat_cache(self):
+        """Format the cached pages of an older formatter again from their
+        HTML, all of them if forced. Nothing is downloaded."""
+        import concurrent.futures
+        import gzip
+
+        store = self._page_store()
+        if store.read_only:
+            raise RuntimeError("can't reformat the read-only cache %s"
+                               % store.path)
+        html_store = self._html_store()
+
+        def get_html(source, name):
+            html_hash, html = store.get_html(source, name)
+            if html_hash is not None:
+                return html_store.content(html_hash), html_hash
+            # Kept in the archive by an older cppman
+            return html and gzip.decompress(html), None
+
+        pages = []
+        no_html = 0
+        for source in SOURCES:
+            formatter = importlib.import_module(
+                'cppman.formatter.%s' % source[:-4])
+            for name in store.names(source):
+                stamp = pageformat.read_format_stamp(store.get(source, name))
+                if stamp and stamp[1] == formatter.FORMAT_VERSION and \
+                        not self.forced:
+                    continue
+                html_hash, html = store.get_html(source, name)
+                if not stamp or not (html or html_hash and
+                                     html_store.has(html_hash)):
+                    # Cached by an older cppman, or its HTML was replaced
+                    # by a newer fetch
+                    no_html += 1
+                    continue
+                pages.append((source, name, stamp[2]))
+
+        print('Reformatting %d manual pages ...' % len(pages))
+        progress = Progress(len(pages))
+        workers = os.cpu_count() or 1
+        pool = pageformat.format_pool(workers)
+        futures = {}
+
+        def wait():
+            done, _ = concurrent.futures.wait(
+                futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                source, name, title, html_hash = futures.pop(future)
+                try:
+                    store.put(source, name, future.result(), html_hash)
+                except Exception as e:
+                    progress.message('Error reformatting %s: %s'
+                                     % (title, e))
+                    progress.add(False)
+                else:
+                    progress.add(True)
 
-        # There are often some errors in the HTML, for example: missing closing
-        # tag. We use fixupHTML to fix this.
-        data = util.fixupHTML(util.urlopen(url).read())
+        try:
+            for source, name, title in pages:
+                # At most a few pages of HTML wait to be formatted
+                while len(futures) >= 2 * workers:
+                    wait()
+                html, html_hash = get_html(source, name)
+                if html is None:
+                    progress.message('Error reformatting %s: its HTML was '
+                                     'removed' % title)
+                    progress.add(False)
+                    continue
+                future = pool.submit(pageformat.format_page, source, title, html)
+                futures[future] = (source, name, title, html_hash)
+            while futures:
+                wait()
+        except BaseException:
+            pool.shutdown(wait=False)
+            raise
+        pool.shutdown()
+        progress.finish()
+
+        self.success_count = progress.succeeded
+        self.failure_count = progress.failed
+
+        print('\n%d manual pages reformatted successfully.'
+              % self.success_count)
+        print('%d manual pages failed to reformat.' % self.failure_count)
+        if no_html:
+            print("%d manual pages have no HTML to reformat, run 'cppman "
+                  "--force-update --cache-all' to cache them again." % no_html)
+        self.update_mandb(False)
 
-        formatter = importlib.import_module(
-            'cppman.formatter.%s' % source[:-4])
-        groff_text = formatter.html2groff(data, name)
+    def set_cache_size(self, size):
+        """ Limit the archive of cached pages to size bytes, 0 for no limit.
+            Returns the number of pages evicted to fit.
+        """
+        store = self._page_store()
+        store.max_size = size
+        return store.evict()
 
-        with gzip.open(outname, 'w') as f:
-            f.write(groff_text.encode('utf-8'))
+    def cache_stats(self, hottest=10):
+        """ Print the size of the caches, the hit rate of lookups and the
+            most looked up pages.
+        """
+        def size(n):
+            return '%.1f MiB' % (n / 1024.0 / 1024.0)
+
+        sources, pages = self._page_store().stats(hottest)
+        count = sum(s[0] for s in sources.values())
+        total = sum(s[1] for s in sources.values())
+        limit = self.page_store.max_size
+        print('Cached pages: %d, %s of %s' %
+              (count, size(total), size(limit) if limit else 'no limit'))
+        if self.page_store.path != environ.page_db:
+            print('  shared cache %s cannot be created, using the cache of '
+                  'the user' % environ.page_db)
+        elif environ.shared_cache_dir:
+            print('  shared in %s' % environ.shared_cache_dir)
+        if self.page_store.read_only:
+            print('  read-only, lookups are not counted')
+        for source in sorted(sources):
+            count, total, hits, misses = sources[source]
+            print('  %s: %d pages, %s' % (source, count, size(total)))
+
+        hits = sum(s[2] for s in sources.values())
+        lookups = hits + sum(s[3] for s in sources.values())
+        print('Lookups: %d, %d answered from the cache (%.1f%%)' %
+              (lookups, hits, 100.0 * hits / lookups if lookups else 0))
+
+        count, total = self._render_cache().stats()
+        print('Rendered pages: %d, %s of %s' %
+              (count, size(total), size(self.render_cache.max_size)))
+
+        disk = 0
+        for root, dirs, files in os.walk(environ.cache_dir):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if not os.path.islink(path):
+                    disk += os.path.getsize(path)
+        print('Cache directory: %s, %s' % (environ.cache_dir, size(disk)))
+
+        if pages:
+            print('Most looked up pages:')
+            for source, name, hits in pages:
+                print('  %6d  %s (%s)' % (hits, name, source))
 
     def clear_cache(self):
         """Clear all cache in man"""
+        for store in (self.page_store, self.render_cache):
+            if store is not None:
+                store.close()
+        self.page_store = self.render_cache = None
         shutil.rmtree(environ.cache_dir)
 
-    def _fetch_page_by_keyword(self, keyword):
-        """ fetches result for a keyword """
-        return self.cursor.execute(
-            'SELECT t1.title, t2.keyword, t1.url '
-            'FROM "%s" AS t1 '
-            'JOIN "%s_keywords" AS t2 '
-            'WHERE t1.id = t2.id AND t2.keyword '
-            'LIKE ? ORDER BY t2.keyword'
-            % (self.source, self.source), ['%%%s%%' % keyword]).fetchall()
-
-    def _search_keyword(self, pattern):
-        """ multiple fetches for each pattern """
-        if not os.path.exists(environ.index_db):
-            raise RuntimeError("can't find index.db")
+    def _has_table(self, table, column='rowid'):
+        """ check whether the index provides table (and column) """
+        try:
+            self.cursor.execute(
+                'SELECT t."%s" FROM "%s" AS t LIMIT 0' % (column, table))
+        except sqlite3.OperationalError:
+            # Index built by an older version or SQLite lacking FTS5
+            return False
+        return True
 
-        conn = sqlite3.connect(environ.index_db)
-        self.cursor = conn.cursor()
-        self.source = environ.source
+    def _fetch_page_by_keyword(self, keyword, limit=-1):
+        """ fetches the best limit entries whose keyword contains keyword
 
-        self.cursor.execute('PRAGMA case_sensitive_like=ON')
+            0. exact match goes first
+            1. sort by 'std::' (an entry with `std::` goes before an entry without)
+            2. sort by which position the keyword appears
+        """
+        if self.keyword_index:
+            tables = ('"%s_keywords_fts" AS t3 '
+                      'JOIN "%s_keywords" AS t2 ON t2.rowid = t3.rowid '
+                      'JOIN "%s" AS t1 ON t1.id = t2.id '
+                      'WHERE t3.keyword GLOB ?'
+                      % (self.source, self.source, self.source))
+            arg = '*%s*' % _glob_escape(keyword)
+        else:
+            tables = ('"%s" AS t1 JOIN "%s_keywords" AS t2 '
+                      "WHERE t1.id = t2.id AND t2.keyword LIKE ? ESCAPE '\\'"
+                      % (self.source, self.source))
+            arg = '%%%s%%' % _like_escape(keyword)
 
-        std_results = []
-        if not pattern.startswith('std::'):
-            std_pattern = 'std::' + pattern
-            std_results = self._fetch_page_by_keyword("%s" % std_pattern)
-            std_results.extend(self._fetch_page_by_keyword("%s %%" % std_pattern))
-            std_results.extend(self._fetch_page_by_keyword("%% %s" % std_pattern))
-            std_results.extend(self._fetch_page_by_keyword("%% %s %%" % std_pattern))
-            std_results.extend(self._fetch_page_by_keyword("%s%%" % std_pattern))
-            std_results = list(set(std_results))
+        if self.rank_columns:
+            has_std = ('t2.has_std', 't1.has_std')
+        else:
+            has_std = ("instr(t2.keyword, 'std::') > 0",
+                       "instr(t1.title, 'std::') > 0")
 
-            if len(std_results) >= 5:
-                conn.close()
-                return sorted(std_results, key=lambda e: _sort_search(e, std_pattern))
+        return self.cursor.execute(
+            'SELECT DISTINCT t1.title, t2.keyword, t1.url FROM %s '
+            'ORDER BY t2.keyword = ? DESC, %s DESC, %s DESC, '
+            'instr(t2.keyword, ?), t2.keyword, t1.title LIMIT ?'
+            % ((tables,) + has_std),
+            [arg, keyword, keyword, limit]).fetchall()
+
+    def _open_index(self):
+        """ open a connection to the index database for searching """
+        if not os.path.exists(environ.index_db):
+            raise RuntimeError("can't find index.db")
+        return sqlite3.connect(environ.index_db)
 
-        results = self._fetch_page_by_keyword("%s" % pattern)
-        results.extend(self._fetch_page_by_keyword("%s %%" % pattern))
-        results.extend(self._fetch_page_by_keyword("%% %s" % pattern))
-        results.extend(self._fetch_page_by_keyword("%% %s %%" % pattern))
+    def _search_keyword(self, pattern, limit=-1):
+        """ search the best limit entries containing pattern, preferring
+            the std:: variant
 
-        results.extend(self._fetch_page_by_keyword("%s%%" % pattern))
-        if len(results) == 0:
-            results = self._fetch_page_by_keyword("%%%s%%" % pattern)
+            A search that fails while a rebuild replaces the index database
+            is retried shortly after on the new one.
+        """
+        for attempt in range(SEARCH_RETRIES):
+            try:
+                return self._search_index(pattern, limit)
+            except sqlite3.DatabaseError:
+                if attempt == SEARCH_RETRIES - 1:
+                    raise
+                time.sleep(SEARCH_RETRY_DELAY)
+
+    def _search_index(self, pattern, limit):
+        conn = self._open_index()
+        self.cursor = conn.cursor()
 
-        results.extend(std_results)
+        if limit < 1:
+            limit = -1
 
-        conn.close()
-        return sorted(list(set(results)), key=lambda e: _sort_search(e, pattern))
+        self.cursor.execute('PRAGMA case_sensitive_like=ON')
+        self.keyword_index = self._has_table('%s_keywords_fts' % self.source)
+        self.rank_columns = self._has_table('%s_keywords' % self.source,
+                                            'has_std')
 
-    def man(self, pattern):
-        """Call viewer.sh to view man page"""
-        results = self._search_keyword(pattern)
-        if len(results) == 0:
-            raise RuntimeError('No manual entry for %s ' % pattern)
+        try:
+            if not pattern.startswith('std::'):
+                std_pattern = 'std::' + pattern
+                std_results = self._fetch_page_by_keyword(
+                    std_pattern, -1 if limit == -1 else max(limit, 5))
 
-        page_name, keyword, url = results[0]
+                if len(std_results) >= 5:
+                    return std_results if limit == -1 else std_results[:limit]
 
-        try:
-            avail = os.listdir(os.path.join(environ.cache_dir, environ.source))
-        except OSError:
-            avail = []
+            # Every entry containing std:: + pattern also contains pattern
+            return self._fetch_page_by_keyword(pattern, limit)
+        finally:
+            conn.close()
 
-        page_filename = self.get_normalized_page_name(page_name)
-        if self.forced or page_filename + '.3.gz' not in avail:
-            self.cache_man_page(environ.source, url, page_name)
+    def man(self, pattern, entry=None):
+        """Call viewer.sh to view man page
 
-        pager_type = environ.pager if sys.stdout.isatty() else 'pipe'
+        entry is the (title, keyword, url) tuple pattern resolves to, as
+        returned by fuzzy_find(). The index is only searched without it.
+        Returns the pid of the pager, None if the page was written to a
+        standard output that is not a terminal.
+        """
+        if entry is None:
+            results = self._search_keyword(pattern, 1)
+            if len(results) == 0:
+                raise RuntimeError('No manual entry for %s ' % pattern)
+            entry = results[0]
 
-        # Call viewer
+        page = self.get_cached_page(entry)
         columns = (util.get_width() if self.force_columns == -1 else
                    self.force_columns)
-        pid = os.fork()
-        if pid == 0:
-            os.execl('/bin/sh', '/bin/sh', environ.pager_script, pager_type,
-                     self.get_page_path(environ.source, page_name),
-                     str(columns), environ.pager_config, pattern)
-        return pid
+
+        if not sys.stdout.isatty():
+            # Plain text for pipes and editors, without groff and col
+            text = pageformat.plain_text(page, columns, util.get_device())
+            sys.stdout.buffer.write(text.encode('utf-8'))
+            sys.stdout.flush()
+            return None
+
+        # Call viewer
+        return util.run_pager(environ.pager, self.render_page(page, columns),
+                              columns, pattern)
+
+    def get_cached_page(self, entry):
+        """Return the gzipped cached page of entry, caching it first if it
+        is not available yet. The lookup is counted in the statistics of
+        the archive."""
+        page_name, keyword, url = entry
+        store = self._page_store()
+        name = self.get_normalized_page_name(page_name)
+        hit = not self.forced and store.has(self.source, name)
+        page = self.cache_man_page(self.source, url, page_name)
+        store.access(self.source, name, hit)
+        return page
 
     def find(self, pattern):
         """Find pages in database."""
@@ -614,19 +1481,20 @@ class Cppman(Crawler):
             raise RuntimeError('%s: nothing appropriate.' % pattern)
 
     def fuzzy_find(self, pattern, max_results, show_menu=False):
-        """Find pages in database and optionally present an interactive selection menu."""
-        results = self._search_keyword(pattern)
-        if max_results >= 1:
-            results = results[:max_results]
+        """Find pages in database and optionally present an interactive selection menu.
+
+        Returns the selected (title, keyword, url) entry or None if cancelled.
+        """
+        results = self._search_keyword(pattern, max_results)
 
         if not results:
             raise RuntimeError('%s: nothing appropriate.' % pattern)
 
         if len(results) == 1:
-            return results[0][1]
+            return results[0]
 
         if not show_menu:
-            return results[0][1]
+            return results[0]
 
         page_size = 20
         current_page = 0
@@ -663,7 +1531,7 @@ class Cppman(Crawler):
 
                 idx = int(selection) - 1
                 if 0 <= idx < len(results):
-                    return results[idx][1]
+                    return results[idx]
                 print("Invalid selection. Please try again.")
             except ValueError:
                 print("Please enter a valid number or navigation command.")
@@ -672,9 +1540,16 @@ class Cppman(Crawler):
                 return None
 
     def update_mandb(self, quiet=True):
-        """Update mandb."""
+        """Export the pages of the current source to the man3 directory
+        and update mandb."""
         if not environ.config.UpdateManPath:
             return
+        import subprocess
+
+        source = environ.config.Source
+        self._page_store().export(source,
+                                  os.path.join(environ.cache_dir, source))
+
         print('\nrunning mandb...')
         cmd = 'mandb %s' % (' -q' if quiet else '')
         subprocess.Popen(cmd, shell=True).wait()
@@ -683,5 +1558,7 @@ class Cppman(Crawler):
         return name.replace('/', '_')
 
     def get_page_path(self, source, name):
+        """Path of the page in the man3 directory exported for mandb"""
         name = self.get_normalized_page_name(name)
         return os.path.join(environ.cache_dir, source, name + '.3.gz')
+
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# pageformat.py - Formatting and rendering of cached man pages
+#
+# Copyright (C) 2010 - 2016  Wei-Ning Huang (AZ) <aitjcize@gmail.com>
+# All Rights reserved.
+#
+# This file is part of cppman.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import importlib
+import re
+
+from cppman import util
+
+# Last line of a cached page: its source, the FORMAT_VERSION of the
+# formatter and its name. man reads preprocessor hints from the first line.
+FORMAT_STAMP = '.\\" cppman %s %d: %s\n'
+FORMAT_STAMP_RE = re.compile(r'\.\\" cppman (\S+) (\d+): (.*)\n')
+
+
+def format_page(source, name, data):
+    """ Convert the HTML page data of source to gzipped groff, runs in the
+        formatting processes of cache_all.
+    """
+    import gzip
+
+    # There are often some errors in the HTML, for example: missing closing
+    # tag. We use fixupHTML to fix this.
+    data = util.fixupHTML(data)
+
+    formatter = importlib.import_module('cppman.formatter.%s' % source[:-4])
+    groff_text = formatter.html2groff(data, name)
+    if not groff_text.endswith('\n'):
+        groff_text += '\n'
+    groff_text += FORMAT_STAMP % (source, formatter.FORMAT_VERSION, name)
+    return gzip.compress(groff_text.encode('utf-8'))
+
+
+def render_page(page, columns, device):
+    """ Render the gzipped page with groff for the output device like
+        pager.sh does, runs in the formatting processes of cache_all.
+        Falls back to cppman.renderer where groff is not installed.
+    """
+    import gzip
+    import subprocess
+
+    try:
+        return subprocess.run(
+            ['groff', '-t', '-c', '-m', 'man', '-T' + device,
+             '-rLL=%dn' % columns, '-rLT=%dn' % columns],
+            input=gzip.decompress(page), stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL).stdout
+    except FileNotFoundError:
+        # Without groff, render the bold and underlined text of grotty -c
+        from cppman import renderer
+        return renderer.render(gzip.decompress(page).decode('utf-8'), columns,
+                               device, overstrike=True).encode('utf-8')
+
+
+def plain_text(page, columns, device):
+    """ Render the gzipped page as plain text for the output device like
+        `pager.sh pipe' does, with cppman.renderer instead of groff and col.
+    """
+    import gzip
+    from cppman import renderer
+
+    return renderer.render(gzip.decompress(page).decode('utf-8'), columns,
+                           device)
+
+
+def _ignore_sigint():
+    # Ctrl-C is handled by the parent process
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def format_pool(workers):
+    """ Pool of worker processes for format_page, or threads where
+        processes are not available
+    """
+    import concurrent.futures
+
+    try:
+        import multiprocessing
+        # Forking while the fetching threads hold locks is unsafe
+        return concurrent.futures.ProcessPoolExecutor(
+            workers, multiprocessing.get_context('spawn'),
+            initializer=_ignore_sigint)
+    except (ImportError, NotImplementedError, OSError):
+        return concurrent.futures.ThreadPoolExecutor(workers)
+
+
+def read_format_stamp(page):
+    """ Return (source, format version, name) from the stamp of the
+        gzipped page, None if it has none.
+    """
+    import gzip
+    import zlib
+
+    try:
+        last_line = gzip.decompress(page).decode('utf-8').rsplit(
+            '\n', 2)[-2:]
+    except (IOError, EOFError, zlib.error, UnicodeDecodeError):
+        return None
+    m = FORMAT_STAMP_RE.fullmatch('\n'.join(last_line))
+    if m is None:
+        return None
+    return m.group(1), int(m.group(2)), m.group(3)
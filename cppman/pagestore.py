@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+#
+# pagestore.py - Archive of cached man pages
+#
+# Copyright (C) 2010 - 2016  Wei-Ning Huang (AZ) <aitjcize@gmail.com>
+# All Rights reserved.
+#
+# This file is part of cppman.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from cppman import util
+
+# Bytes of the archive mapped into memory, reads of mapped pages do not copy
+# them through the file system cache
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Bytes of compressed rendered pages kept by RenderCache before the least
+# recently used are evicted
+RENDER_CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+
+class PageStore(object):
+    """Formatted man pages of all sources in a single SQLite file.
+
+    Each page is a row keyed by its source and normalized name, holding the
+    gzipped groff of the page and the hash of the HTML it was formatted from
+    in the HTMLStore. Pages cached by older versions keep their gzipped
+    HTML in the archive.
+    The store is shared by the threads of cache_all and by other processes.
+
+    Lookups of pages are counted with access(). When the pages take more
+    than max_size bytes (0 for no limit), the pages never looked up and then
+    the least recently looked up ones are evicted.
+
+    An archive the user cannot write, e.g. a shared cache of other users, is
+    opened read-only: its pages are looked up but nothing is stored, counted
+    or evicted.
+    """
+
+    def __init__(self, path, max_size=0):
+        self.path = path
+        self.max_size = max_size
+        # Whether the archive was created, and should be filled with the
+        # pages of an older cppman
+        self.created = not os.path.exists(path)
+        if self.created:
+            # Writable by the users sharing the directory
+            util.create_like_parent(path)
+        # The WAL files are created next to the archive
+        self.read_only = not (os.access(path, os.W_OK) and
+                              os.access(os.path.dirname(path) or '.',
+                                        os.W_OK))
+
+        self._lock = threading.Lock()
+        if self.read_only:
+            self._conn = self._connect_read_only(path)
+            self._conn.execute('PRAGMA mmap_size=%d' % MMAP_SIZE)
+            return
+
+        self._conn = sqlite3.connect(path, timeout=30,
+                                     check_same_thread=False)
+        # Readers do not block the writer, and a lost page is cached again
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA mmap_size=%d' % MMAP_SIZE)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'source VARCHAR(255) NOT NULL, '
+            'name VARCHAR(255) NOT NULL, '
+            'page BLOB NOT NULL, '
+            'html BLOB, '
+            'html_hash VARCHAR(40), '
+            'updated REAL NOT NULL, '
+            'size INTEGER, '
+            'accessed REAL, '
+            'hits INTEGER NOT NULL DEFAULT 0, '
+            'PRIMARY KEY (source, name)'
+            ')')
+        # Archives of older versions lack the access statistics and keep
+        # the HTML of the pages themselves
+        columns = [row[1] for row in
+                   self._conn.execute('PRAGMA table_info(pages)')]
+        for column, definition in (('html_hash', 'VARCHAR(40)'),
+                                   ('size', 'INTEGER'),
+                                   ('accessed', 'REAL'),
+                                   ('hits', 'INTEGER NOT NULL DEFAULT 0')):
+            if column not in columns:
+                self._conn.execute('ALTER TABLE pages ADD COLUMN %s %s' %
+                                   (column, definition))
+        self._conn.execute(
+            'UPDATE pages SET size = LENGTH(page) + COALESCE(LENGTH(html), 0) '
+            'WHERE size IS NULL')
+        # Pages are evicted in this order
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS pages_lru ON pages('
+            'accessed IS NOT NULL, accessed)')
+
+        # Bytes of all pages, kept up to date by the triggers
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS total_size (bytes INTEGER NOT NULL)')
+        self._conn.execute(
+            'INSERT INTO total_size SELECT COALESCE(SUM(size), 0) FROM pages '
+            'WHERE NOT EXISTS (SELECT 1 FROM total_size)')
+        self._conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS pages_insert AFTER INSERT ON pages '
+            'BEGIN UPDATE total_size SET bytes = bytes + NEW.size; END')
+        self._conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS pages_delete AFTER DELETE ON pages '
+            'BEGIN UPDATE total_size SET bytes = bytes - OLD.size; END')
+        self._conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS pages_update AFTER UPDATE OF size '
+            'ON pages BEGIN UPDATE total_size SET bytes = bytes - OLD.size + '
+            'NEW.size; END')
+
+        # Lookups of each source, answered from the store or not
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS lookups ('
+            'source VARCHAR(255) NOT NULL PRIMARY KEY, '
+            'hits INTEGER NOT NULL, '
+            'misses INTEGER NOT NULL'
+            ')')
+        self._conn.commit()
+
+    @staticmethod
+    def _connect_read_only(path):
+        from urllib.parse import quote
+
+        uri = 'file:%s?mode=ro' % quote(os.path.abspath(path))
+        conn = sqlite3.connect(uri, uri=True, timeout=30,
+                               check_same_thread=False)
+        try:
+            conn.execute('SELECT 1 FROM sqlite_master').fetchall()
+        except sqlite3.OperationalError:
+            # Reading a WAL archive needs its shared memory file, which is
+            # only missing when no writer has the archive open
+            conn.close()
+            conn = sqlite3.connect(uri.replace('mode=ro', 'immutable=1'),
+                                   uri=True, check_same_thread=False)
+        return conn
+
+    def has(self, source, name):
+        """Whether the page name of source is in the store"""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT 1 FROM pages WHERE source = ? AND name = ?',
+                (source, name)).fetchone() is not None
+
+    def get(self, source, name):
+        """Return the gzipped page name of source, None if it is not in the
+        store"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT page FROM pages WHERE source = ? AND name = ?',
+                (source, name)).fetchone()
+        return row and row[0]
+
+    def put(self, source, name, page, html_hash=None):
+        """Store the gzipped page name of source and the hash of the HTML
+        it was formatted from. Without html_hash, the HTML a page formatted
+        again was known by is kept. Nothing is stored in a read-only
+        store."""
+        if self.read_only:
+            return
+        with self._lock:
+            # Keeps the statistics of a page formatted again
+            self._conn.execute(
+                'INSERT INTO pages (source, name, page, html_hash, updated, '
+                'size) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (source, name) '
+                'DO UPDATE SET page = excluded.page, '
+                'html = CASE WHEN excluded.html_hash IS NULL THEN html END, '
+                'html_hash = COALESCE(excluded.html_hash, html_hash), '
+                'updated = excluded.updated, '
+                'size = excluded.size + CASE WHEN excluded.html_hash IS NULL '
+                'THEN COALESCE(LENGTH(html), 0) ELSE 0 END',
+                (source, name, page, html_hash, time.time(), len(page)))
+            self._evict((source, name))
+            self._conn.commit()
+
+    def access(self, source, name, hit):
+        """Count a lookup of the page name of source, hit if it was found in
+        the store. Lookups are not counted in a read-only store."""
+        if self.read_only:
+            return
+        with self._lock:
+            self._conn.execute(
+                'UPDATE pages SET accessed = ?, hits = hits + 1 WHERE '
+                'source = ? AND name = ?', (time.time(), source, name))
+            self._conn.execute(
+                'INSERT INTO lookups VALUES (?, ?, ?) ON CONFLICT (source) DO '
+                'UPDATE SET hits = hits + excluded.hits, '
+                'misses = misses + excluded.misses',
+                (source, int(hit), int(not hit)))
+            self._conn.commit()
+
+    def _evict(self, keep=None):
+        if not self.max_size or self.read_only:
+            return 0
+        size, = self._conn.execute(
+            'SELECT bytes FROM total_size').fetchone()
+        if size <= self.max_size:
+            return 0
+
+        evicted = []
+        for source, name, length in self._conn.execute(
+                'SELECT source, name, size FROM pages '
+                'ORDER BY accessed IS NOT NULL, accessed'):
+            if size <= self.max_size:
+                break
+            if (source, name) == keep:
+                continue
+            evicted.append((source, name))
+            size -= length
+        self._conn.executemany(
+            'DELETE FROM pages WHERE source = ? AND name = ?', evicted)
+        return len(evicted)
+
+    def evict(self):
+        """Evict pages until the store holds at most max_size bytes, returns
+        the number of pages evicted"""
+        if self.read_only:
+            return 0
+        with self._lock:
+            evicted = self._evict()
+            self._conn.commit()
+        return evicted
+
+    def get_html(self, source, name):
+        """Return the hash in the HTMLStore of the HTML the page name of
+        source was formatted from and the gzipped HTML kept by older
+        versions, (None, None) if neither is known"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT html_hash, html FROM pages WHERE source = ? AND '
+                'name = ?', (source, name)).fetchone()
+        return row or (None, None)
+
+    def names(self, source):
+        """Return the names of all pages of source"""
+        with self._lock:
+            return [name for name, in self._conn.execute(
+                'SELECT name FROM pages WHERE source = ? ORDER BY name',
+                (source,))]
+
+    def import_files(self, source, page_dir, html_dir):
+        """Add the <name>.3.gz pages in page_dir and their <name>.html.gz
+        HTML in html_dir, as cached by older versions of cppman"""
+        try:
+            filenames = sorted(os.listdir(page_dir))
+        except OSError:
+            return 0
+
+        rows = []
+        for filename in filenames:
+            if not filename.endswith('.3.gz'):
+                continue
+            name = filename[:-5]
+            try:
+                with open(os.path.join(page_dir, filename), 'rb') as f:
+                    page = f.read()
+            except OSError:
+                continue
+            try:
+                with open(os.path.join(html_dir, name + '.html.gz'),
+                          'rb') as f:
+                    html = f.read()
+            except OSError:
+                html = None
+            rows.append((source, name, page, html,
+                         os.path.getmtime(os.path.join(page_dir, filename)),
+                         len(page) + len(html or b'')))
+
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO pages (source, name, page, html, '
+                'updated, size) VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._evict()
+            self._conn.commit()
+        return len(rows)
+
+    def export(self, source, directory):
+        """Write the pages of source as <name>.3.gz files into directory,
+        the layout of a man3 section. Files newer than their page are kept,
+        files of pages no longer in the store are removed.
+        Returns the number of files written."""
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT name, updated FROM pages WHERE source = ?',
+                (source,)).fetchall()
+
+        names = set(name + '.3.gz' for name, _ in rows)
+        for filename in os.listdir(directory):
+            if filename.endswith('.3.gz') and filename not in names:
+                try:
+                    os.remove(os.path.join(directory, filename))
+                except OSError:
+                    pass
+
+        written = 0
+        for name, updated in rows:
+            path = os.path.join(directory, name + '.3.gz')
+            try:
+                if os.path.getmtime(path) >= updated:
+                    continue
+            except OSError:
+                pass
+            page = self.get(source, name)
+            if page is None:
+                continue
+            tmp_path = '%s.%d' % (path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                f.write(page)
+            os.replace(tmp_path, path)
+            written += 1
+        return written
+
+    def stats(self, hottest=10):
+        """Return the number of pages, their bytes and the lookup hits and
+        misses of each source, and the hottest most looked up pages as
+        (source, name, hits) tuples"""
+        with self._lock:
+            sources = {}
+            for source, count, size in self._conn.execute(
+                    'SELECT source, COUNT(*), TOTAL(size) FROM pages '
+                    'GROUP BY source'):
+                sources[source] = [count, int(size), 0, 0]
+            for source, hits, misses in self._conn.execute(
+                    'SELECT source, hits, misses FROM lookups'):
+                sources.setdefault(source, [0, 0, 0, 0])[2:] = [hits, misses]
+            pages = self._conn.execute(
+                'SELECT source, name, hits FROM pages WHERE hits > 0 '
+                'ORDER BY hits DESC, accessed DESC LIMIT ?',
+                (hottest,)).fetchall()
+        return sources, pages
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RenderCache(object):
+    """Pages as rendered by groff, keyed by the page, the number of columns
+    and the output device.
+
+    The page is identified by the hash of its gzipped groff, which includes
+    the version of the formatter. The least recently used pages are evicted
+    when the cache holds more than max_size bytes.
+    """
+
+    def __init__(self, path, max_size=RENDER_CACHE_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS rendered ('
+            'hash VARCHAR(40) NOT NULL, '
+            'columns INTEGER NOT NULL, '
+            'device VARCHAR(16) NOT NULL, '
+            'text BLOB NOT NULL, '
+            'used REAL NOT NULL, '
+            'PRIMARY KEY (hash, columns, device)'
+            ')')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS rendered_used ON rendered(used)')
+        # Bytes of all rendered pages, kept up to date by the triggers
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS size (bytes INTEGER NOT NULL)')
+        self._conn.execute(
+            'INSERT INTO size SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM size)')
+        self._conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS rendered_insert AFTER INSERT ON '
+            'rendered BEGIN UPDATE size SET bytes = bytes + '
+            'LENGTH(NEW.text); END')
+        self._conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS rendered_delete AFTER DELETE ON '
+            'rendered BEGIN UPDATE size SET bytes = bytes - '
+            'LENGTH(OLD.text); END')
+        self._conn.commit()
+
+    def _key(self, page, columns, device):
+        return hashlib.sha1(page).hexdigest(), columns, device
+
+    def get(self, page, columns, device):
+        """Return the page rendered at columns for device, None if it is not
+        in the cache"""
+        import zlib
+
+        key = self._key(page, columns, device)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT text FROM rendered WHERE hash = ? AND columns = ? '
+                'AND device = ?', key).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                'UPDATE rendered SET used = ? WHERE hash = ? AND '
+                'columns = ? AND device = ?', (time.time(),) + key)
+            self._conn.commit()
+        return zlib.decompress(row[0])
+
+    def has(self, page, columns, device):
+        """Whether the page rendered at columns for device is cached"""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT 1 FROM rendered WHERE hash = ? AND columns = ? '
+                'AND device = ?',
+                self._key(page, columns, device)).fetchone() is not None
+
+    def put(self, page, columns, device, text):
+        """Cache text, the page rendered at columns for device"""
+        import zlib
+
+        key = self._key(page, columns, device)
+        with self._lock:
+            # Not INSERT OR REPLACE, which skips the delete trigger
+            self._conn.execute(
+                'DELETE FROM rendered WHERE hash = ? AND columns = ? AND '
+                'device = ?', key)
+            self._conn.execute(
+                'INSERT INTO rendered (hash, columns, device, text, used) '
+                'VALUES (?, ?, ?, ?, ?)', key + (zlib.compress(text),
+                                                time.time()))
+            size, = self._conn.execute('SELECT bytes FROM size').fetchone()
+            if size > self.max_size:
+                evicted = []
+                for hash, columns, device, length in self._conn.execute(
+                        'SELECT hash, columns, device, LENGTH(text) '
+                        'FROM rendered ORDER BY used'):
+                    if size <= self.max_size:
+                        break
+                    evicted.append((hash, columns, device))
+                    size -= length
+                self._conn.executemany(
+                    'DELETE FROM rendered WHERE hash = ? AND columns = ? '
+                    'AND device = ?', evicted)
+            self._conn.commit()
+
+    def stats(self):
+        """Return the number of rendered pages and their bytes"""
+        with self._lock:
+            count, = self._conn.execute(
+                'SELECT COUNT(*) FROM rendered').fetchone()
+            size, = self._conn.execute('SELECT bytes FROM size').fetchone()
+        return count, size
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
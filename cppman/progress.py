@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# progress.py - Progress of long-running cache operations
+#
+# Copyright (C) 2010 - 2016  Wei-Ning Huang (AZ) <aitjcize@gmail.com>
+# All Rights reserved.
+#
+# This file is part of cppman.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import sys
+import threading
+import time
+
+
+class Progress(object):
+    """ Progress of cache_all, shown as a live line with the throughput and
+        the time left on a terminal, and every few seconds otherwise.
+    """
+
+    def __init__(self, total, interval=10):
+        self.total = total
+        self.succeeded = 0
+        self.failed = 0
+        self.interval = interval
+        self.start = self.last_line = time.time()
+        self.live = sys.stdout.isatty()
+        self.lock = threading.Lock()
+
+    def message(self, text):
+        """ print text above the live line """
+        with self.lock:
+            if self.live:
+                sys.stdout.write('\r\033[K')
+            print(text)
+            self._draw()
+
+    def note(self, text):
+        """ print text unless the live line shows the progress """
+        if not self.live:
+            self.message(text)
+
+    def add(self, succeeded):
+        with self.lock:
+            if succeeded:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+            self._draw()
+
+    def refresh(self):
+        with self.lock:
+            if self.live:
+                self._draw()
+            elif time.time() - self.last_line >= self.interval:
+                print(self._line())
+                self.last_line = time.time()
+
+    def finish(self):
+        if self.live:
+            sys.stdout.write('\n')
+
+    def _line(self):
+        done = self.succeeded + self.failed
+        rate = done / max(time.time() - self.start, 1e-3)
+        if rate:
+            eta = '%d:%02d' % divmod(int((self.total - done) / rate), 60)
+        else:
+            eta = '-:--'
+        return '%d/%d pages, %.1f pages/s, ETA %s' % (done, self.total,
+                                                       rate, eta)
+
+    def _draw(self):
+        if self.live:
+            sys.stdout.write('\r\033[K' + self._line())
+            sys.stdout.flush()
@@ -0,0 +1,970 @@
+# -*- coding: utf-8 -*-
+#
+# renderer.py - Render cached pages as text without groff
+#
+# Copyright (C) 2010 - 2016  Wei-Ning Huang (AZ) <aitjcize@gmail.com>
+# All Rights reserved.
+#
+# This file is part of cppman.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+"""Render the groff written by the formatters as `groff -t -c -m man' does
+on a terminal device, for the man macros, requests and tbl tables they use.
+"""
+
+# Indentation of paragraphs, of subsection headings and the default
+# indentation of tagged paragraphs, in columns
+IN = 7
+SN = 3
+
+# Columns between two tab stops, 0.5i at 10 characters per inch
+TAB_WIDTH = 5
+
+# Characters per inch of the terminal devices
+_CPI = 10
+
+# Output of special characters, (ascii, utf8)
+_GLYPHS = {
+    'bu': ('o', '•'),
+    'dq': ('"', '"'),
+    'aq': ("'", "'"),
+    'lq': ('"', '“'),
+    'rq': ('"', '”'),
+    'oq': ('`', '‘'),
+    'cq': ("'", '’'),
+    'aa': ("'", '´'),
+    'ga': ('`', '`'),
+    'hy': ('-', '‐'),
+    'mi': ('-', '−'),
+    'en': ('-', '–'),
+    'em': ('--', '—'),
+    'rs': ('\\', '\\'),
+    'sl': ('/', '/'),
+    'ti': ('~', '~'),
+    'ha': ('^', '^'),
+    'pl': ('+', '+'),
+    'eq': ('=', '='),
+    'mu': ('x', '×'),
+    'di': ('/', '÷'),
+    '+-': ('+-', '±'),
+    '<=': ('<=', '≤'),
+    '>=': ('>=', '≥'),
+    '!=': ('!=', '≠'),
+    'ra': ('->', '→'),
+    'la': ('<-', '←'),
+    'ua': ('^', '↑'),
+    'da': ('v', '↓'),
+    'co': ('(C)', '©'),
+    'rg': ('(R)', '®'),
+    'tm': ('tm', '™'),
+    'sc': ('S', '§'),
+    'de': ('o', '°'),
+    'Fo': ('<<', '«'),
+    'Fc': ('>>', '»'),
+}
+
+# Input characters output as other glyphs on the utf8 device
+_UTF8_CHARS = {'-': '‐', "'": '’', '`': '‘'}
+
+# Characters after which a line may be broken, like groff's .cflags 2
+_BREAK_AFTER = ('-', '‐', '—', '--')
+
+# Characters ending a sentence, and the ones that may follow them
+_SENTENCE_END = '.?!'
+_TRANSPARENT = '"\')]*’”'
+
+# Box drawing characters by the lines joining at them, (up, down, left,
+# right), on the utf8 device
+_BOX = {
+    (False, True, False, True): '┌',
+    (False, True, True, True): '┬',
+    (False, True, True, False): '┐',
+    (True, True, False, True): '├',
+    (True, True, True, True): '┼',
+    (True, True, True, False): '┤',
+    (True, False, False, True): '└',
+    (True, False, True, True): '┴',
+    (True, False, True, False): '┘',
+    (True, True, False, False): '│',
+    (False, False, True, True): '─',
+    (True, False, False, False): '│',
+    (False, True, False, False): '│',
+    (False, False, True, False): '─',
+    (False, False, False, True): '─',
+}
+
+_FONTS = {'B': 'B', 'I': 'I', 'BI': 'B', 'R': 'R', 'P': 'P', '1': 'R',
+          '2': 'I', '3': 'B', '4': 'B', 'CW': 'R', 'CR': 'R', 'CB': 'B',
+          'CI': 'I'}
+
+
+def _args(text):
+    """Split the arguments of a macro, reading them in copy mode"""
+    args = []
+    i = 0
+    n = len(text)
+    while i < n:
+        while i < n and text[i] in ' \t':
+            i += 1
+        if i >= n:
+            break
+        if text[i] == '"':
+            i += 1
+            arg = []
+            while i < n:
+                if text[i] == '"':
+                    if text[i + 1:i + 2] == '"':
+                        arg.append('"')
+                        i += 2
+                        continue
+                    i += 1
+                    break
+                arg.append(text[i])
+                i += 1
+            args.append(''.join(arg))
+        else:
+            start = i
+            while i < n and text[i] not in ' \t':
+                i += 1
+            args.append(text[start:i])
+    return [arg.replace('\\\\', '\\') for arg in args]
+
+
+def _number(text, default_unit, current=0):
+    """The value of the numeric argument text in columns or lines, relative
+    to current if it starts with a sign"""
+    text = text.strip()
+    sign = ''
+    if text[:1] in '+-':
+        sign, text = text[0], text[1:]
+    unit = default_unit
+    if text[-1:].isalpha():
+        unit, text = text[-1], text[:-1]
+    try:
+        value = float(text) if text else 0.0
+    except ValueError:
+        return current
+    value *= {'i': _CPI, 'c': _CPI / 2.54, 'p': _CPI / 72.0,
+              'P': _CPI / 6.0, 'u': 1 / 24.0}.get(unit, 1)
+    value = int(value + 0.5)
+    if sign == '+':
+        return current + value
+    if sign == '-':
+        return current - value
+    return value
+
+
+class _Fragment(object):
+    """Unbreakable run of glyphs in a filled line, and the space before it"""
+
+    __slots__ = ('space', 'spaces', 'glyphs', 'width')
+
+    def __init__(self, space, spaces, glyphs):
+        self.space = space
+        self.spaces = spaces
+        self.glyphs = glyphs
+        self.width = sum(len(c) for c, _ in glyphs)
+
+
+class _Renderer(object):
+    def __init__(self, width, utf8, state):
+        self.width = width
+        self.utf8 = utf8
+        # groff alternates the side extra space is added from on each
+        # adjusted line of the whole document
+        self.state = state
+
+        self.lines = []
+        self.pending_space = 0
+        self.no_space = False
+
+        self.fill = True
+        self.adjust = True
+        self.font = 'R'
+        self.prev_font = 'R'
+        self.indent = 0
+        self.prev_indent = 0
+        self.temp_indent = None
+
+        # The line being filled
+        self.line = []
+        self.line_width = 0
+        self.join_next = False
+        self.sentence_end = False
+
+        # State of the man macros
+        self.margin = IN
+        self.prevailing = IN
+        self.saved_margins = []
+        self.trap = None
+        # The next line of text, also of a font macro, is the tag of a TP
+        self.tag_next = False
+        self.header = None
+
+    # Glyphs
+
+    def _char(self, c):
+        if self.utf8:
+            return _UTF8_CHARS.get(c, c)
+        return c
+
+    def _glyph(self, name):
+        glyph = _GLYPHS.get(name)
+        if glyph is None:
+            return name if len(name) == 1 else ''
+        return glyph[self.utf8]
+
+    def _set_font(self, name):
+        name = _FONTS.get(name, 'R')
+        if name == 'P':
+            self.font, self.prev_font = self.prev_font, self.font
+        else:
+            self.font, self.prev_font = name, self.font
+
+    def glyphs(self, text):
+        """Return the glyphs of text as (string, font) pairs, ' ' stands for
+        a space the line may be broken at and adjusted"""
+        out = []
+        i = 0
+        n = len(text)
+        while i < n:
+            c = text[i]
+            i += 1
+            if c == '\t':
+                out.append(('\t', self.font))
+                continue
+            if c != '\\':
+                out.append((self._char(c), self.font))
+                continue
+            if i >= n:
+                break
+            e = text[i]
+            i += 1
+            while e == 'E' and i < n:
+                e = text[i]
+                i += 1
+
+            if e == 'f':
+                if text[i:i + 1] == '(':
+                    name, i = text[i + 1:i + 3], i + 3
+                elif text[i:i + 1] == '[':
+                    end = text.find(']', i)
+                    end = n if end < 0 else end
+                    name, i = text[i + 1:end], end + 1
+                else:
+                    name, i = text[i:i + 1], i + 1
+                self._set_font(name or 'P')
+            elif e == '(':
+                out.append((self._glyph(text[i:i + 2]), self.font))
+                i += 2
+            elif e == '[':
+                end = text.find(']', i)
+                end = n if end < 0 else end
+                out.append((self._glyph(text[i:end]), self.font))
+                i = end + 1
+            elif e in '\\e':
+                out.append(('\\', self.font))
+            elif e == '-':
+                out.append((self._glyph('mi'), self.font))
+            elif e in ' 0~':
+                out.append(('\xa0', self.font))
+            elif e == "'":
+                out.append((self._glyph('aa'), self.font))
+            elif e == '`':
+                out.append((self._glyph('ga'), self.font))
+            elif e in '&|^%:)/,cd':
+                # Nothing to output in nroff mode
+                out.append(('', self.font))
+            elif e in '"#':
+                break
+            elif e in 'n*gk':
+                if text[i:i + 1] in '+-' and e == 'n':
+                    i += 1
+                if text[i:i + 1] == '(':
+                    i += 3
+                elif text[i:i + 1] == '[':
+                    end = text.find(']', i)
+                    i = n if end < 0 else end + 1
+                else:
+                    i += 1
+            elif e == 's':
+                if text[i:i + 1] in '+-':
+                    i += 1
+                if text[i:i + 1] in '([':
+                    end = text.find(')' if text[i] == '(' else ']', i)
+                    i = n if end < 0 else end + 1
+                else:
+                    while i < n and text[i].isdigit():
+                        i += 1
+            elif e in 'hvwoxlLDbXZHSNRAB' and i < n:
+                # Escapes with a delimited argument
+                end = text.find(text[i], i + 1)
+                i = n if end < 0 else end + 1
+            elif e == 't':
+                out.append(('\t', self.font))
+            else:
+                out.append((self._char(e), self.font))
+        return out
+
+    # Output
+
+    def _space(self, lines):
+        if not self.no_space:
+            self.pending_space += lines
+
+    def _output(self, cells, indent=0):
+        """Add a line of (string, font) cells after the pending space"""
+        self.lines.extend([] for _ in range(self.pending_space))
+        self.pending_space = 0
+        self.no_space = False
+        while cells and cells[-1][0] in (' ', '\xa0', ''):
+            cells = cells[:-1]
+        self.lines.append([(' ', 'R')] * max(indent, 0) + cells)
+
+    def _line_indent(self):
+        if self.temp_indent is not None:
+            return self.temp_indent
+        return self.indent
+
+    def _emit_line(self, adjust):
+        """Output the filled line, adjusted to the line length if adjust"""
+        line = self.line
+        indent = self._line_indent()
+        self.temp_indent = None
+        self.line = []
+        self.line_width = 0
+
+        spaces = sum(f.spaces for f in line[1:] if f.space)
+        desired = self.width - indent - sum(
+            f.width + (f.space if i else 0) for i, f in enumerate(line))
+        extra = [0] * len(line)
+        if adjust and self.adjust and spaces and desired > 0:
+            # Like groff, give every space an equal share rounded to whole
+            # columns, starting from the right or the left end in turn
+            order = range(1, len(line))
+            if not self.state['reverse']:
+                order = reversed(order)
+            units = desired * 24
+            for i in order:
+                for _ in range(line[i].spaces if line[i].space else 0):
+                    if spaces == 1:
+                        share = units
+                    else:
+                        share = (units // spaces + 11) // 24 * 24
+                    extra[i] += share
+                    units -= share
+                    spaces -= 1
+            self.state['reverse'] = not self.state['reverse']
+
+        cells = []
+        for i, f in enumerate(line):
+            if i:
+                cells.extend([(' ', 'R')] * (f.space + extra[i] // 24))
+            cells.extend(f.glyphs)
+        self._output(cells, indent)
+
+    def _break(self):
+        if self.line:
+            self._emit_line(False)
+        self.join_next = False
+        self.sentence_end = False
+
+    def _add_fragment(self, fragment):
+        available = self.width - self._line_indent()
+        space = fragment.space if self.line else 0
+        if self.line and self.line_width + space + fragment.width > available:
+            self._emit_line(True)
+            space = 0
+        self.line.append(fragment)
+        self.line_width += space + fragment.width
+
+    def _fill(self, glyphs, first_space):
+        """Add the glyphs of an input line to the filled line"""
+        space, spaces = first_space
+        run = []
+
+        def flush():
+            if run:
+                self._add_fragment(_Fragment(space, spaces, list(run)))
+                del run[:]
+
+        for c, font in glyphs:
+            if c == ' ':
+                if run:
+                    flush()
+                    space, spaces = 0, 0
+                space += 1
+                spaces += 1
+                continue
+            if c == '\t':
+                c = ' '
+            run.append((c, font))
+            if c in _BREAK_AFTER and len(run) > 1:
+                flush()
+                space, spaces = 0, 0
+        flush()
+
+    def _text(self, text):
+        """Handle a text line"""
+        if self.trap is not None:
+            trap, self.trap = self.trap, None
+            trap(text)
+            return
+        if self.tag_next:
+            self.tag_next = False
+            self._tag(self.glyphs(text))
+            return
+
+        if not self.fill:
+            self._no_fill_line(text)
+            return
+
+        if not text.strip():
+            self._break()
+            self._space(1)
+            return
+
+        if text[0] == ' ':
+            self._break()
+            stripped = text.lstrip(' ')
+            text = '\\ ' * (len(text) - len(stripped)) + stripped
+
+        glyphs = self.glyphs(text)
+        if self.join_next or not self.line:
+            first_space = (0, 0)
+        elif self.sentence_end:
+            first_space = (2, 1)
+        else:
+            first_space = (1, 1)
+        self._fill(glyphs, first_space)
+
+        self.join_next = text.endswith('\\c')
+        chars = ''.join(c for c, _ in glyphs).rstrip(' ').rstrip(_TRANSPARENT)
+        self.sentence_end = bool(chars) and chars[-1] in _SENTENCE_END and \
+            bool(glyphs) and glyphs[-1][0] != ''
+
+    def _no_fill_line(self, text):
+        cells = []
+        for c, font in self.glyphs(text):
+            if c == '\t':
+                cells.extend([(' ', 'R')] * (TAB_WIDTH - len(cells) %
+                                             TAB_WIDTH))
+            elif c == '\xa0':
+                cells.append((' ', font))
+            elif c:
+                cells.append((c, font))
+        indent = self._line_indent()
+        self.temp_indent = None
+        self._output(cells, indent)
+
+    # Requests and macros
+
+    def _font_macro(self, fonts, args):
+        if not args:
+            def trap(text):
+                font = self.font
+                self.font = fonts[0]
+                self._text(text)
+                self.font = font
+            self.trap = trap
+            return
+        # A single font sets the arguments apart, alternating fonts join
+        # them
+        if len(fonts) == 1:
+            args = [' '.join(args)]
+        font = self.font
+        glyphs = []
+        for i, arg in enumerate(args):
+            self.font = fonts[i % len(fonts)]
+            glyphs.extend(self.glyphs(arg))
+        self.font = font
+        if self.tag_next:
+            self.tag_next = False
+            self._tag(glyphs)
+            return
+        if not self.fill:
+            self._no_fill_line(''.join(args))
+            return
+        if self.join_next or not self.line:
+            first_space = (0, 0)
+        else:
+            first_space = (2, 1) if self.sentence_end else (1, 1)
+        self._fill(glyphs, first_space)
+        chars = ''.join(c for c, _ in glyphs).rstrip(_TRANSPARENT)
+        self.sentence_end = bool(chars) and chars[-1] in _SENTENCE_END
+        self.join_next = False
+
+    def _heading(self, indent, args):
+        self._break()
+        self._space(1)
+        self.margin = self.prevailing = IN
+        self.saved_margins = []
+
+        def heading(text):
+            self.indent = self.temp_indent = indent
+            font = self.font
+            self.font = 'B'
+            self._fill(self.glyphs(text), (0, 0))
+            self.font = font
+            self._break()
+            self.indent = self.margin
+            self.no_space = True
+
+        if args:
+            heading(' '.join(args))
+        else:
+            self.trap = heading
+
+    def _paragraph(self):
+        self._break()
+        self._space(1)
+        self.fill = True
+        self.font = 'R'
+
+    def _tagged_paragraph(self, tag, width):
+        self._paragraph()
+        if width is not None:
+            self.prevailing = _number(width, 'n')
+        self.indent = self.margin + self.prevailing
+        if tag is not None:
+            self._tag(self.glyphs(tag))
+
+    def _tag(self, glyphs):
+        tag_width = sum(len(c) for c, _ in glyphs)
+        self.temp_indent = self.margin
+        if tag_width < self.prevailing:
+            glyphs = [(' ' if c == '\xa0' else c, font)
+                      for c, font in glyphs]
+            glyphs += [(' ', 'R')] * (self.prevailing - tag_width)
+            self.line = [_Fragment(0, 0, glyphs)]
+            self.line_width = self.prevailing
+            self.join_next = True
+        else:
+            self._fill(glyphs, (0, 0))
+            self._break()
+
+    def _request(self, line):
+        name, _, rest = line[1:].lstrip(' \t').partition(' ')
+        if name.startswith('\\"') or name.startswith('\\#'):
+            return
+        args = _args(rest)
+
+        if name == 'TH':
+            self.header = (args + [''] * 5)[:5]
+            self.no_space = True
+        elif name == 'SH':
+            self._heading(0, args)
+        elif name == 'SS':
+            self._heading(SN, args)
+        elif name in ('PP', 'LP', 'P', 'HP'):
+            self._paragraph()
+            self.prevailing = IN
+            self.indent = self.margin
+        elif name == 'IP':
+            self._tagged_paragraph(args[0] if args else '',
+                                   args[1] if len(args) > 1 else None)
+        elif name == 'TP':
+            self._tagged_paragraph(None, args[0] if args else None)
+            self.tag_next = True
+        elif name == 'RS':
+            self._break()
+            self.saved_margins.append((self.margin, self.prevailing))
+            if args:
+                self.margin += _number(args[0], 'n')
+            else:
+                self.margin += self.prevailing
+            self.prevailing = IN
+            self.indent = self.margin
+        elif name == 'RE':
+            self._break()
+            if self.saved_margins:
+                self.margin, self.prevailing = self.saved_margins.pop()
+            self.indent = self.margin
+        elif name in ('B', 'I', 'R', 'SB', 'SM'):
+            self._font_macro({'SB': 'B', 'SM': 'R'}.get(name, name), args)
+        elif name in ('BR', 'RB', 'BI', 'IB', 'IR', 'RI'):
+            self._font_macro(name, args)
+        elif name == 'br':
+            self._break()
+        elif name == 'sp':
+            self._break()
+            self._space(_number(args[0], 'v') if args else 1)
+        elif name == 'nf':
+            self._break()
+            self.fill = False
+        elif name == 'fi':
+            self._break()
+            self.fill = True
+        elif name == 'in':
+            self._break()
+            value = (_number(args[0], 'm', self.indent) if args
+                     else self.prev_indent)
+            self.indent, self.prev_indent = max(value, 0), self.indent
+        elif name == 'ti':
+            self._break()
+            if args:
+                self.temp_indent = max(_number(args[0], 'm', self.indent), 0)
+        elif name == 'ft':
+            self._set_font(args[0] if args else 'P')
+        elif name == 'ad':
+            self.adjust = not args or args[0] in ('b', 'n')
+        elif name == 'na':
+            self.adjust = False
+        elif name == 'ns':
+            self.no_space = True
+        elif name == 'rs':
+            self.no_space = False
+
+    def render(self, lines):
+        """Format the input lines"""
+        i = 0
+        n = len(lines)
+        while i < n:
+            line = lines[i]
+            i += 1
+            # Escaped newlines join input lines
+            while line.endswith('\\') and \
+                    (len(line) - len(line.rstrip('\\'))) % 2 and i < n:
+                line = line[:-1] + lines[i]
+                i += 1
+            if line.startswith('.TS'):
+                i = self._table(lines, i)
+            elif line[:1] in ('.', "'"):
+                self._request(line)
+            else:
+                self._text(line)
+        self._break()
+
+    # Tables
+
+    def _table(self, lines, i):
+        """Format the table starting at lines[i] and return the index of the
+        line after it"""
+        self._break()
+        n = len(lines)
+        tab = '\t'
+        box = allbox = center = expand = False
+        if i < n and ';' in lines[i]:
+            options = lines[i].lower()
+            i += 1
+            allbox = 'allbox' in options
+            box = allbox or 'box' in options or 'frame' in options
+            center = 'center' in options
+            expand = 'expand' in options
+            start = options.find('tab(')
+            if start >= 0 and start + 4 < len(options):
+                tab = lines[i - 1][start + 4]
+
+        formats = []
+        while i < n:
+            line = lines[i].rstrip()
+            i += 1
+            last = line.endswith('.')
+            if last:
+                line = line[:-1]
+            specs = []
+            j = 0
+            while j < len(line):
+                c = line[j]
+                if c.lower() in 'lrcnas^':
+                    specs.append([c.lower(), False])
+                elif c in 'xX' and specs:
+                    specs[-1][1] = True
+                elif c in 'wW' and line[j + 1:j + 2] == '(':
+                    end = line.find(')', j)
+                    j = len(line) if end < 0 else end
+                j += 1
+            if specs:
+                formats.append(specs)
+            if last:
+                break
+        if not formats:
+            formats = [[['l', False]]]
+
+        rows = []
+        while i < n and not lines[i].startswith('.TE'):
+            line = lines[i]
+            i += 1
+            if line.startswith('.') or line in ('_', '='):
+                continue
+            row = []
+            while True:
+                fields = line.split(tab)
+                row.extend(('text', f) for f in fields[:-1])
+                if fields[-1] != 'T{':
+                    row.append(('text', fields[-1]))
+                    break
+                block = []
+                while i < n and not lines[i].startswith('T}'):
+                    block.append(lines[i])
+                    i += 1
+                rest = lines[i][2:] if i < n else ''
+                i += 1
+                row.append(('block', block))
+                if not rest.startswith(tab):
+                    break
+                line = rest[len(tab):]
+            rows.append(row)
+        i += 1
+
+        if rows:
+            self._format_table(rows, formats, box, allbox, center, expand)
+        return i
+
+    def _block(self, block, width, state):
+        renderer = _Renderer(width, self.utf8, state)
+        renderer.margin = renderer.prevailing = 0
+        renderer.adjust = self.adjust
+        renderer.render(block)
+        return renderer.lines
+
+    def _format_table(self, rows, formats, box, allbox, center, expand):
+        ncols = max(max(len(f) for f in formats), max(len(r) for r in rows))
+        line_length = self.width
+        available = self.width - self.indent
+
+        # The cells of each row: (kind, content, first column, columns)
+        table = []
+        for r, row in enumerate(rows):
+            specs = formats[min(r, len(formats) - 1)]
+            specs = specs + [['l', False]] * (ncols - len(specs))
+            cells = []
+            data = iter(row)
+            for c in range(ncols):
+                kind = specs[c][0]
+                if kind == 's' and cells:
+                    cells[-1][3] += 1
+                    continue
+                entry = next(data, ('text', ''))
+                if kind == '^' or entry == ('text', '\\^'):
+                    cells.append(['^', None, c, 1, 'l'])
+                else:
+                    cells.append([entry[0], entry[1], c, 1, kind])
+            table.append(cells)
+
+        x_columns = set()
+        for specs in formats:
+            for c, spec in enumerate(specs):
+                if spec[1]:
+                    x_columns.add(c)
+        if expand and not x_columns:
+            x_columns = set(range(ncols))
+
+        # Natural widths, text blocks are measured filled to the default
+        # width of tbl
+        widths = [0] * ncols
+        measured = {}
+        for cells in table:
+            for cell in cells:
+                kind, content, c, span, _ = cell
+                if kind == 'text':
+                    w = sum(len(g) for g, _ in self.glyphs(content))
+                elif kind == 'block':
+                    limit = line_length * span // (ncols + 1)
+                    block = self._block(content, limit, {'reverse': False})
+                    w = max([len(l) for l in block] + [0])
+                    measured[id(cell)] = limit, w
+                else:
+                    continue
+                if span == 1:
+                    widths[c] = max(widths[c], w)
+        for cells in table:
+            for cell in cells:
+                kind, content, c, span, _ = cell
+                if span > 1 and kind != '^':
+                    if kind == 'text':
+                        w = sum(len(g) for g, _ in self.glyphs(content))
+                    else:
+                        w = measured[id(cell)][1]
+                    have = sum(widths[c:c + span]) + 3 * (span - 1)
+                    if w > have:
+                        widths[c + span - 1] += w - have
+
+        border = 3 * ncols if box else 3 * (ncols - 1)
+        if x_columns:
+            extra = available - sum(widths) - border
+            if extra > 0:
+                columns = sorted(x_columns)
+                for k, c in enumerate(columns):
+                    widths[c] += extra // len(columns) + \
+                        (1 if k < extra % len(columns) else 0)
+
+        # Column positions, a box puts the rules in the middle of the
+        # column separation
+        starts = []
+        pos = 1 if box else 0
+        for c in range(ncols):
+            starts.append(pos)
+            pos += widths[c] + 3
+        total = pos - 2 if box else pos - 3
+        indent = self.indent
+        if center:
+            indent = max(self.indent + (available - total) // 2, 0)
+
+        def cell_width(c, span):
+            return sum(widths[c:c + span]) + 3 * (span - 1)
+
+        state = self.state
+        rendered = []
+        for cells in table:
+            row = []
+            for cell in cells:
+                kind, content, c, span, align = cell
+                w = cell_width(c, span)
+                if kind == 'text':
+                    lines = [self.glyphs(content)]
+                elif kind == 'block':
+                    fill_width = w if c in x_columns else measured[id(cell)][0]
+                    lines = self._block(content, fill_width, state)
+                else:
+                    lines = []
+                lines = [[(' ' if g == '\xa0' else g, f) for g, f in line
+                          if g] for line in lines]
+                block_width = max([len(l) for l in lines] + [0])
+                if align == 'c':
+                    offset = (w - block_width) // 2
+                elif align in ('r', 'n'):
+                    offset = w - block_width
+                else:
+                    offset = 0
+                row.append((c, span, kind, offset, lines))
+            rendered.append(row)
+
+        def vertical_lines(row):
+            # The boundaries with a rule in the row
+            rules = set([0, ncols])
+            for c, span, _, _, _ in row:
+                rules.add(c)
+            return rules
+
+        def rule(above, below):
+            cells = [(' ', 'R')] * (total + 1)
+            up = vertical_lines(above) if above is not None else set()
+            down = vertical_lines(below) if below is not None else set()
+            spanned = set()
+            if below is not None:
+                for c, span, kind, _, _ in below:
+                    if kind == '^':
+                        spanned.update(range(c, c + span))
+            for c in range(ncols):
+                if c in spanned:
+                    continue
+                left = starts[c] - 2 if c else 0
+                right = starts[c] + widths[c] + 1
+                for p in range(left + 1, right):
+                    cells[p] = (self._box(False, False, True, True), 'R')
+            for b in range(ncols + 1):
+                p = starts[b] - 2 if b < ncols else total
+                if b == 0:
+                    p = 0
+                lines = (b in up, b in down,
+                         b > 0 and b - 1 not in spanned,
+                         b < ncols and b not in spanned)
+                cells[p] = (self._box(*lines), 'R')
+            return cells
+
+        for r, row in enumerate(rendered):
+            if allbox or (box and r == 0):
+                self._output(rule(rendered[r - 1] if r else None, row),
+                             indent)
+            height = max([len(lines) for _, _, _, _, lines in row] + [1])
+            for k in range(height):
+                cells = [(' ', 'R')] * (total + 1 if box else total)
+                for c, span, kind, offset, lines in row:
+                    if k < len(lines):
+                        start = starts[c] + offset
+                        for p, cell in enumerate(lines[k]):
+                            if start + p < len(cells):
+                                cells[start + p] = cell
+                            else:
+                                cells.append(cell)
+                if box:
+                    for b in vertical_lines(row) if allbox else (0, ncols):
+                        p = starts[b] - 2 if 0 < b < ncols else \
+                            (0 if b == 0 else total)
+                        cells[p] = (self._box(True, True, False, False), 'R')
+                self._output(cells, indent)
+        if box:
+            self._output(rule(rendered[-1], None), indent)
+
+    def _box(self, up, down, left, right):
+        if self.utf8:
+            return _BOX.get((up, down, left, right), ' ')
+        if up or down:
+            return '+' if left or right else '|'
+        return '-' if left or right else ' '
+
+    # Header and footer
+
+    def _title(self, left, center, right):
+        length = self.width
+        line = []
+
+        def put(pos, text):
+            pos = max(pos, 0)
+            if len(line) < pos + len(text):
+                line.extend(' ' * (pos + len(text) - len(line)))
+            line[pos:pos + len(text)] = text
+
+        left = ''.join(c for c, _ in self.glyphs(left))
+        center = ''.join(c for c, _ in self.glyphs(center))
+        right = ''.join(c for c, _ in self.glyphs(right))
+        space = length - len(center)
+        put(0, left)
+        put(space - space // 2, center)
+        put(length - len(right), right)
+        return [(c, 'R') for c in ''.join(line).rstrip()]
+
+    def finish(self):
+        """Add the header and the footer of the page"""
+        if self.header is None:
+            return
+        title, section, date, source, manual = self.header
+        page = '%s(%s)' % (title, section)
+        self.font = 'R'
+        self.lines.insert(0, [])
+        self.lines.insert(0, self._title(page, manual, page))
+        self.no_space = False
+        self._space(1)
+        self._output(self._title(source, date, page))
+
+
+def render(text, columns, device='ascii', overstrike=False):
+    """Render the groff text of a page at columns like groff -t -c -m man
+    -T<device> does.
+
+    Bold and italic text are overstruck and underlined with backspaces if
+    overstrike is true, for pagers that show them.
+    """
+    renderer = _Renderer(columns, device == 'utf8', {'reverse': False})
+    renderer.render(text.rstrip('\n').split('\n'))
+    renderer.finish()
+
+    out = []
+    for line in renderer.lines:
+        chars = []
+        for c, font in line:
+            if c == '\xa0':
+                c = ' '
+            if overstrike and font == 'B' and c.strip():
+                chars.append(''.join('%s\b%s' % (g, g) for g in c))
+            elif overstrike and font == 'I' and c.strip():
+                chars.append(''.join('_\b%s' % g for g in c))
+            else:
+                chars.append(c)
+        out.append(''.join(chars).rstrip())
+    return '\n'.join(out) + '\n'
@@ -22,12 +22,14 @@
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 #
 
+import collections
+import contextlib
 import os
 import shutil
-import subprocess
-import urllib.request
+import threading
+import time
+from urllib.parse import urljoin, urlparse
 
-import bs4
 from cppman import environ
 
 # User-Agent header value to use with all requests
@@ -79,6 +81,51 @@ def update_man3_link():
     os.symlink(environ.config.Source, man3_path)
 
 
+def makedirs_like_parent(path):
+    """Create the directory path with the permissions of its parent, so that
+    the users sharing a cache directory can write to it"""
+    if os.path.isdir(path):
+        return
+    os.makedirs(path, exist_ok=True)
+    try:
+        os.chmod(path, os.stat(os.path.dirname(path)).st_mode & 0o7777)
+    except OSError:
+        pass
+
+
+def create_like_parent(path):
+    """Create the empty file path unless it exists, readable and writable by
+    the users who can write to its directory"""
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return
+    try:
+        os.fchmod(fd, os.stat(os.path.dirname(path)).st_mode & 0o666)
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on the file path, created if needed, while in
+    the context. Other threads and processes locking path wait for it.
+    Nothing is locked if path cannot be created."""
+    import fcntl
+
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_CREAT, 0o644)
+    except OSError:
+        fd = None
+    try:
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
 def get_width():
     """Get terminal width"""
     # Get terminal size
@@ -87,16 +134,49 @@ def get_width():
     return width
 
 
+def get_device(locale=None):
+    """Get the groff output device for the locale, a (LC_ALL, LANG) pair
+    that defaults to the environment, like pager.sh does"""
+    if locale is None:
+        locale = (os.getenv('LC_ALL', ''), os.getenv('LANG', ''))
+    for var in locale:
+        if 'utf8' in (var or '').replace('-', '').lower():
+            return 'utf8'
+    return 'ascii'
+
+
+def run_pager(pager_type, text, columns, page_name):
+    """Fork pager.sh to show the page text rendered by groff, returns the pid
+    of the pager."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(write_fd)
+        os.dup2(read_fd, 0)
+        os.close(read_fd)
+        os.execl('/bin/sh', '/bin/sh', environ.pager_script, pager_type,
+                 '-', str(columns), environ.pager_config, page_name)
+    os.close(read_fd)
+
+    def feed():
+        # The pager may quit before it read the whole page
+        try:
+            with os.fdopen(write_fd, 'wb') as f:
+                f.write(text)
+        except BrokenPipeError:
+            pass
+
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+    return pid
+
+
 def groff2man(data):
     """Read groff-formatted text and output man pages."""
-    width = get_width()
+    from cppman import renderer
 
-    cmd = 'groff -t -Tascii -m man -rLL=%dn -rLT=%dn' % (width, width)
-    handle = subprocess.Popen(
-        cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    man_text, stderr = handle.communicate(data)
-    return man_text
+    return renderer.render(data, get_width())
 
 
 def html2man(data, formatter):
@@ -107,19 +187,152 @@ def html2man(data, formatter):
 
 
 def fixupHTML(data):
+    import bs4
     return str(bs4.BeautifulSoup(data, "html5lib"))
 
-def urlopen(url, *args, **kwargs):
-    """A wrapper around urllib.request.urlopen() which adds custom headers"""
-    if isinstance(url, urllib.request.Request):
-        req = url
-    else:
-        req = urllib.request.Request(url)
-    req.add_header('User-Agent', _USER_AGENT)
-    return urllib.request.urlopen(req, *args, **kwargs)
-
-def build_opener(*args, **kwargs):
-    """A wrapper around urllib.request.build_opener() which adds custom headers"""
-    opener = urllib.request.build_opener(*args, **kwargs)
-    opener.addheaders = [('User-Agent', _USER_AGENT)]
-    return opener
+class Response(object):
+    """A completely read HTTP response"""
+
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def read(self):
+        return self.body
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of persistent (keep-alive) HTTP connections.
+
+    Up to maxsize idle connections are kept per (scheme, host) and handed to
+    one request at a time, so fetching many pages from the same site only
+    pays for a few TCP and TLS handshakes.
+    """
+
+    def __init__(self, maxsize=16, timeout=10):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def _get_connection(self, key):
+        with self._lock:
+            if self._idle[key]:
+                return self._idle[key].pop()
+
+        import http.client
+        scheme, netloc = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _put_connection(self, key, conn):
+        with self._lock:
+            if len(self._idle[key]) < self.maxsize:
+                self._idle[key].append(conn)
+                return
+        conn.close()
+
+    def request(self, url, headers=None, method='GET'):
+        """Send a request for url and return its Response.
+
+        Redirections are not followed.
+        """
+        import http.client
+
+        parts = urlparse(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError('unsupported URL scheme: %s' % url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        request_headers = {'User-Agent': _USER_AGENT}
+        request_headers.update(headers or {})
+
+        while True:
+            conn = self._get_connection(key)
+            reused = conn.sock is not None
+            try:
+                conn.request(method, path, headers=request_headers)
+                res = conn.getresponse()
+                body = res.read()
+            except (ConnectionError, http.client.BadStatusLine):
+                conn.close()
+                # The server closed an idle connection, retry on a new one
+                if reused:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+
+            if res.will_close:
+                conn.close()
+            else:
+                self._put_connection(key, conn)
+            return Response(url, res.status, res.reason, res.msg, body)
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, collections.defaultdict(list)
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+# Connections shared by the crawler and page fetches
+pool = ConnectionPool()
+
+
+class RateLimiter(object):
+    """Thread-safe limit of the rate of requests to each host.
+
+    wait() blocks until the next request to the host of a URL may be sent,
+    at most rate requests per second are sent to the same host (0 for no
+    limit).
+    """
+
+    def __init__(self, rate=0):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def urlopen(url, max_redirects=5):
+    """Fetch url through the connection pool, following redirections.
+
+    Raises urllib.error.HTTPError if the server answers with an error.
+    """
+    for _ in range(max_redirects + 1):
+        res = pool.request(url)
+        location = res.getheader('Location')
+        if res.status in (301, 302, 303, 307, 308) and location:
+            url = urljoin(url, location)
+            continue
+        if res.status >= 400:
+            import io
+            import urllib.error
+            raise urllib.error.HTTPError(url, res.status, res.reason,
+                                         res.headers, io.BytesIO(res.body))
+        return res
+    raise RuntimeError('too many redirections for %s' % url)
@@ -4,12 +4,25 @@ complete -c $progname -f
 
 complete -c $progname -s s -l source -a "cppreference.com cplusplus.com" -d "Select source"
 complete -c $progname -s c -l cache-all -d "Cache all available man pages from cppreference.com and cplusplus.com to enable offline browsing"
+complete -c $progname -l prerender -d "Comma-separated terminal widths at which '--cache-all' renders the cached pages ahead of time"
+complete -c $progname -l reformat-cache -d "Format cached man pages again after the formatter changed, without downloading them"
 complete -c $progname -s C -l clear-cache -d "Clear all cached files"
+complete -c $progname -l cache-size -d "Maximum size of the cached pages in MiB, 0 for no limit"
+complete -c $progname -l shared-cache -d "Directory of a page cache shared by the users of the host"
+complete -c $progname -l cache-stats -d "Show the size of the cache, how many lookups it answered and the most viewed pages"
 complete -c $progname -s f -l find-page -d "Find man page"
 complete -c $progname -s o -l force-update -d "Force cppman to update existing cache when '--cache-all' or browsing man pages that were already cached"
 complete -c $progname -s m -l use-mandb -a "true false" -d "If true, cppman adds manpage path to mandb so that you can view C++ manpages with 'man' command"
 complete -c $progname -s p -l pager -a "vim nvim less system" -d "Select pager to use"
 complete -c $progname -s r -l rebuild-index -d "rebuild index database for the selected source"
+complete -c $progname -l refresh-index -d "Update the index with the pages that changed since the last '--rebuild-index'"
+complete -c $progname -l resume -d "Continue an interrupted '--rebuild-index' from its last checkpoint"
+complete -c $progname -l crawler -a "threads asyncio" -d "Crawling engine used by '--rebuild-index'"
+complete -c $progname -l reuse-html -d "Let '--rebuild-index' use the pages fetched in the last day"
+complete -c $progname -l per-host -d "Maximum number of requests in flight to the same host with the 'asyncio' crawler"
+complete -c $progname -l rate -d "Maximum number of requests per second to the same host by '--cache-all'"
+complete -c $progname -s j -l jobs -d "Number of pages fetched concurrently by '--rebuild-index' and '--cache-all'"
 complete -c $progname -s v -l version -d "Show version information"
+complete -c $progname -l daemon -d "Serve lookups of other cppman processes from memory"
 complete -c $progname -l force-columns -d "Force terminal columns"
 complete -c $progname -s h -l help -d "Show help message and exit"
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+#
+# Crawl scheduler microbenchmark: drives Crawler's frontier (_add_target /
+# _next_target) over a synthetic link graph without any network access.
+#
+# Usage: test/bench_crawler.py [NUM_URLS] [LINKS_PER_PAGE]
+
+import os
+import os.path
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.normpath(os.getcwd()))
+
+from cppman.crawler import Crawler
+
+
+def main():
+    num_urls = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    num_links = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    rng = random.Random(0)
+    graph = [['https://bench.invalid/w/cpp/%d' % rng.randrange(num_urls)
+              for _ in range(num_links)] for _ in range(num_urls)]
+
+    crawler = Crawler()
+    crawler.set_follow_mode(Crawler.F_ANY)
+
+    start = time.time()
+    crawler._add_target('https://bench.invalid/w/cpp/0', 1)
+    pops = pushes = 0
+    while True:
+        target = crawler._next_target()
+        if target is None:
+            break
+        depth, url = target
+        pops += 1
+        for link in graph[int(url.rsplit('/', 1)[1])]:
+            crawler._add_target(link, depth + 1)
+            pushes += 1
+    elapsed = time.time() - start
+
+    print('%d URLs scheduled, %d links offered in %.2fs (%.0f links/s)'
+          % (pops, pushes, elapsed, pushes / elapsed))
+
+
+if __name__ == '__main__':
+    main()
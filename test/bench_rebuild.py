@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# Index write benchmark: replays the results of a crawl into a fresh
+# database with Cppman._write_index, without any network access.
+#
+# The results are read from the staging database of the last
+# 'cppman --rebuild-index' ($XDG_CACHE_HOME/cppman/rebuild/<source>.db), or
+# generated from NUM_PAGES synthetic pages when no database is given.
+#
+# Usage: test/bench_rebuild.py [STAGING_DB | NUM_PAGES]
+
+import contextlib
+import io
+import os
+import os.path
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.normpath(os.getcwd()))
+
+from cppman.main import Cppman
+
+NAMES = ['vector', 'basic_string', 'map', 'unordered_map', 'set', 'atomic',
+         'deque', 'chrono::duration', 'filesystem::path', 'ranges::view']
+MEMBERS = ['at', 'size', 'begin', 'end', 'push_back', 'find', 'count',
+           'swap', 'data', 'operator==', 'operator[]', 'emplace', 'is_same']
+FUNCTIONS = ['swap', 'erase', 'operator==']
+
+
+def synthetic_pages(num_pages):
+    """Yield the URL and HTML of pages like the ones on cppreference.com:
+    class templates with a table of typedefs, followed by their members and
+    the overloads of some free functions"""
+    rng = random.Random(0)
+    i = 0
+    while i < num_pages:
+        name = 'std::%s_%d' % (rng.choice(NAMES), i)
+        typedefs = ''.join('<tr><td>%s_t%d %s&lt;char&gt;</td><td>x</td></tr>'
+                           % (name, j, name) for j in range(3))
+        yield ('https://bench.invalid/w/cpp/%d' % i,
+               '<html><h1>%s</h1><table><tr><td>Type</td><td>Definition'
+               '</td></tr>%s</table></html>' % (name, typedefs))
+        i += 1
+        for member in rng.sample(MEMBERS, 8):
+            yield ('https://bench.invalid/w/cpp/%d' % i,
+                   '<html><h1>%s::%s</h1></html>' % (name, member))
+            i += 1
+        # Overloads of free functions share their keywords
+        for function in FUNCTIONS:
+            yield ('https://bench.invalid/w/cpp/%d/%s' % (i, function),
+                   '<html><h1>std::%s</h1></html>' % function)
+            i += 1
+
+
+def main():
+    arg = sys.argv[1] if len(sys.argv) > 1 else '3000'
+
+    cm = Cppman()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if arg.isdigit():
+            cm._open_staging(os.path.join(tmp_dir, 'staging.db'))
+            with contextlib.redirect_stdout(io.StringIO()):
+                for url, content in synthetic_pages(int(arg)):
+                    cm.process_document(url, content, 1)
+        elif os.path.exists(arg):
+            cm._open_staging(arg, keep=True)
+        else:
+            sys.exit("can't open staging database %s" % arg)
+
+        cm.db_conn = sqlite3.connect(os.path.join(tmp_dir, 'index.db'))
+        cm.db_cursor = cm.db_conn.cursor()
+
+        start = time.time()
+        cm._write_index('bench')
+        elapsed = time.time() - start
+
+        pages, = cm.db_cursor.execute(
+            'SELECT COUNT(*) FROM "bench"').fetchone()
+        keywords, = cm.db_cursor.execute(
+            'SELECT COUNT(*) FROM "bench_keywords"').fetchone()
+        cm.db_conn.close()
+        cm.staging_conn.close()
+
+    print('%d pages, %d keywords written in %.2fs'
+          % (pages, keywords, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# Renderer test: renders the groff sources in test/fixtures/render with
+# cppman.renderer and compares them with the output of groff, as
+# `pager.sh pipe' writes it.
+#
+# The expected output of NAME.3 at C columns on device D is NAME.D.C when it
+# is checked in, else the output of the groff installed. Run with --update
+# on a host with groff to write the expected output of all sources.
+#
+# Usage: test/render_fixtures.py [--update]
+
+import difflib
+import glob
+import os
+import os.path
+import re
+import shutil
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.normpath(os.getcwd()))
+
+from cppman import renderer
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'fixtures', 'render')
+DEVICES = ('ascii', 'utf8')
+COLUMNS = (80, 120)
+
+
+def groff(text, columns, device):
+    """Render text like `pager.sh pipe' does"""
+    output = subprocess.run(
+        ['groff', '-t', '-c', '-m', 'man', '-T' + device,
+         '-rLL=%dn' % columns, '-rLT=%dn' % columns],
+        input=text.encode('utf-8'), stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL, check=True).stdout
+    # col -b keeps the last of the overstruck characters
+    return re.sub('.\b', '', output.decode('utf-8'))
+
+
+def main():
+    update = sys.argv[1:] == ['--update']
+    has_groff = shutil.which('groff') is not None
+    if update and not has_groff:
+        print('groff is needed to write the expected output')
+        sys.exit(1)
+
+    total = differ = missing = 0
+    for source in sorted(glob.glob(os.path.join(FIXTURE_DIR, '*.3'))):
+        with open(source, encoding='utf-8') as f:
+            text = f.read()
+        name = os.path.basename(source)[:-2]
+        for device in DEVICES:
+            for columns in COLUMNS:
+                path = os.path.join(FIXTURE_DIR,
+                                    '%s.%s.%d' % (name, device, columns))
+                if update:
+                    with open(path, 'w', encoding='utf-8') as f:
+                        f.write(groff(text, columns, device))
+                    continue
+
+                total += 1
+                if os.path.exists(path):
+                    with open(path, encoding='utf-8') as f:
+                        expected = f.read()
+                elif has_groff:
+                    expected = groff(text, columns, device)
+                else:
+                    print('%s: missing, install groff or run with --update '
+                          'where it is installed' % os.path.basename(path))
+                    missing += 1
+                    continue
+                got = renderer.render(text, columns, device)
+                if got == expected:
+                    continue
+                differ += 1
+                print('%s:' % os.path.basename(path))
+                sys.stdout.writelines(difflib.unified_diff(
+                    expected.splitlines(True), got.splitlines(True),
+                    'groff', 'renderer', n=1))
+
+    if update:
+        return
+    print('%d of %d renderings identical, %d missing' %
+          (total - differ - missing, total, missing))
+    sys.exit(1 if differ or missing else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+#
+# Start-up benchmark: a lookup of a cached page only needs cppman.main and
+# cppman.client. Importing them must not pull in the HTML parsers or the
+# network stack, and must stay within the time budget below.
+
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+
+# Budget for the cumulative import time of the lookup modules (ms)
+BUDGET = 100
+RUNS = 5
+
+LOOKUP_MODULES = ('cppman.main', 'cppman.client')
+FORBIDDEN_MODULES = ('bs4', 'lxml', 'html5lib', 'soupsieve', 'http', 'ssl',
+                     'email', 'urllib.request', 'gzip')
+
+
+def import_times(home):
+    """Import the lookup modules in a fresh interpreter and return the
+    imported module names and the cumulative import time (us) of the lookup
+    modules."""
+    env = dict(os.environ, HOME=home, XDG_CACHE_HOME=home,
+               XDG_CONFIG_HOME=home, PYTHONPATH=os.getcwd())
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         'import %s' % ', '.join(LOOKUP_MODULES)],
+        env=env, stderr=subprocess.PIPE, check=True).stderr.decode()
+
+    names, total = [], 0
+    for line in stderr.splitlines()[1:]:
+        self_time, cumulative, name = line.split(':', 1)[1].split('|')
+        names.append(name.strip())
+        # Nested imports are indented, their time is part of their parent
+        if name.strip() in LOOKUP_MODULES and not name.startswith('  '):
+            total += int(cumulative)
+    return names, total
+
+
+def main():
+    with tempfile.TemporaryDirectory() as home:
+        totals = []
+        for _ in range(RUNS):
+            names, total = import_times(home)
+            forbidden = [name for name in names
+                         if name.split('.')[0] in FORBIDDEN_MODULES or
+                         name in FORBIDDEN_MODULES]
+            if forbidden:
+                sys.exit('lookup imports %s' % ', '.join(sorted(forbidden)))
+            totals.append(total)
+
+    best = min(totals) / 1000.0
+    print('lookup imports: %.1f ms (best of %d, budget %d ms)'
+          % (best, RUNS, BUDGET))
+    if best > BUDGET:
+        sys.exit('start-up budget exceeded')
+
+
+if __name__ == '__main__':
+    main()